@@ -24,9 +24,9 @@ class PerfusionHelper(ScriptedLoadableModule):
             "PerfusionHelper"  # TODO: make this more human readable by adding spaces
         )
         self.parent.categories = ["MikeTools"]
-        self.parent.dependencies = [
-            "Elastix"
-        ]  # TODO: add here list of module names that this module requires
+        # Elastix and SequenceRegistration are only needed by the registration features and are
+        # loaded on first use (see PerfusionHelperLogic.getElastixLogic), not at startup
+        self.parent.dependencies = []
         self.parent.contributors = [
             "Mike Bindschadler (Seattle Children's Hospital)"
         ]  #
@@ -114,6 +114,7 @@ class PerfusionHelperWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         ScriptedLoadableModuleWidget.__init__(self, parent)
         VTKObservationMixin.__init__(self)  # needed for parameter node observation
         self.logic = None
+        self.pipeline = None
         self._parameterNode = None
         self._updatingGUIFromParameterNode = False
 
@@ -134,9 +135,9 @@ class PerfusionHelperWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         # "setMRMLScene(vtkMRMLScene*)" slot.
         uiWidget.setMRMLScene(slicer.mrmlScene)
 
-        # Create logic class. Logic implements all computations that should be possible to run
+        # Get the shared logic instance. Logic implements all computations that should be possible to run
         # in batch mode, without a graphical user interface.
-        self.logic = PerfusionHelperLogic()
+        self.logic = getPerfusionHelperLogic()
 
         # Connections
 
@@ -177,9 +178,21 @@ class PerfusionHelperWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         self.ui.RegistrationStrategyComboBox.connect(
             "currentIndexChanged(int)", self.updateParameterNodeFromGUI
         )
+        self.ui.SequenceRegistrationStrategyComboBox.connect(
+            "currentIndexChanged(int)", self.updateParameterNodeFromGUI
+        )
         self.ui.HardenTransformCheckBox.connect(
             "stateChanged(int)", self.updateParameterNodeFromGUI
         )
+        self.ui.AutoReferenceFrameCheckBox.connect(
+            "stateChanged(int)", self.updateParameterNodeFromGUI
+        )
+        self.ui.SequenceRegBrainMaskCheckBox.connect(
+            "stateChanged(int)", self.updateParameterNodeFromGUI
+        )
+        self.ui.SequenceRegBrainMaskSelector.connect(
+            "currentNodeChanged(vtkMRMLNode*)", self.updateParameterNodeFromGUI
+        )
 
         # Buttons
         self.ui.GatherTagsFromDICOMButton.connect(
@@ -192,10 +205,13 @@ class PerfusionHelperWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
             "clicked(bool)", self.onRunSequenceRegistrationButtonClick
         )
         self.ui.RegisterT1Button.connect("clicked(bool)", self.onRegisterT1ButtonClick)
+        self.ui.RunPipelineButton.connect("clicked(bool)", self.onRunPipelineButtonClick)
 
-        # Initialize registration strategy choice combobox
+        # Initialize registration strategy choice comboboxes
         self.ui.RegistrationStrategyComboBox.clear()
         self.ui.RegistrationStrategyComboBox.addItems(["BRAINS", "Elastix"])
+        self.ui.SequenceRegistrationStrategyComboBox.clear()
+        self.ui.SequenceRegistrationStrategyComboBox.addItems(["Elastix", "BRAINS"])
 
         # Make sure parameter node is initialized (needed for module reload)
         self.initializeParameterNode()
@@ -269,6 +285,9 @@ class PerfusionHelperWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
                 self.updateGUIFromParameterNode,
             )
         self._parameterNode = inputParameterNode
+        # Stage records are only valid for the parameter node they were made with
+        if self.pipeline is None or self.pipeline.parameterNode != inputParameterNode:
+            self.pipeline = PerfusionHelperPipeline(self.logic, inputParameterNode)
         if self._parameterNode is not None:
             self.addObserver(
                 self._parameterNode,
@@ -302,6 +321,9 @@ class PerfusionHelperWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         self.ui.OutputRegisteredSequenceSelector.setCurrentNode(
             pn.GetNodeReference("OutputRegisteredSequence")
         )
+        self.ui.SequenceRegBrainMaskSelector.setCurrentNode(
+            pn.GetNodeReference("SequenceRegBrainMask")
+        )
         self.ui.T1RegSequenceInputSelector.setCurrentNode(
             pn.GetNodeReference("T1RegSequenceInput")
         )
@@ -334,7 +356,7 @@ class PerfusionHelperWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         # Sequence registration section
         if pn.GetNodeReference("InputRegisteredSequence"):
             self.ui.RunSequenceRegistrationButton.toolTip = (
-                "Run sequence registration using default rigid registration settings"
+                "Run rigid sequence registration using the selected sequence registration strategy"
             )
             self.ui.RunSequenceRegistrationButton.enabled = True
         else:
@@ -376,11 +398,35 @@ class PerfusionHelperWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         else:
             self.ui.RegistrationStrategyComboBox.setCurrentIndex(0)
             raise Exception("Unknown registration strategy %s in parameter node!")
+        sequenceStrategyOptionsList = [
+            self.ui.SequenceRegistrationStrategyComboBox.itemText(idx)
+            for idx in range(self.ui.SequenceRegistrationStrategyComboBox.count)
+        ]
+        if pn.GetParameter("SequenceRegistrationStrategy") in sequenceStrategyOptionsList:
+            newIdx = sequenceStrategyOptionsList.index(
+                pn.GetParameter("SequenceRegistrationStrategy")
+            )
+            self.ui.SequenceRegistrationStrategyComboBox.setCurrentIndex(newIdx)
+        else:
+            self.ui.SequenceRegistrationStrategyComboBox.setCurrentIndex(0)
+            raise Exception(
+                "Unknown sequence registration strategy %s in parameter node!"
+                % pn.GetParameter("SequenceRegistrationStrategy")
+            )
 
-        ## Checkbox
+        ## Checkboxes
         self.ui.HardenTransformCheckBox.checked = (
             pn.GetParameter("HardenTransformChecked") == "1"
         )
+        self.ui.AutoReferenceFrameCheckBox.checked = (
+            pn.GetParameter("AutoReferenceFrameChecked") == "1"
+        )
+        self.ui.SequenceRegBrainMaskCheckBox.checked = (
+            pn.GetParameter("SequenceRegBrainMaskChecked") == "1"
+        )
+        self.ui.SequenceRegBrainMaskSelector.enabled = (
+            self.ui.SequenceRegBrainMaskCheckBox.checked
+        )
 
         # All the GUI updates are done
         self._updatingGUIFromParameterNode = False
@@ -399,11 +445,19 @@ class PerfusionHelperWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         )  # Modify all properties in a single batch
         pn = self._parameterNode
 
-        # Checkbox
+        # Checkboxes
         pn.SetParameter(
             "HardenTransformChecked",
             "1" if self.ui.HardenTransformCheckBox.checked else "0",
         )
+        pn.SetParameter(
+            "AutoReferenceFrameChecked",
+            "1" if self.ui.AutoReferenceFrameCheckBox.checked else "0",
+        )
+        pn.SetParameter(
+            "SequenceRegBrainMaskChecked",
+            "1" if self.ui.SequenceRegBrainMaskCheckBox.checked else "0",
+        )
 
         # Set node references from selectors
         pn.SetNodeReferenceID(
@@ -418,6 +472,9 @@ class PerfusionHelperWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
             "OutputRegisteredSequence",
             self.ui.OutputRegisteredSequenceSelector.currentNodeID,
         )
+        pn.SetNodeReferenceID(
+            "SequenceRegBrainMask", self.ui.SequenceRegBrainMaskSelector.currentNodeID
+        )
         pn.SetNodeReferenceID(
             "T1RegSequenceInput", self.ui.T1RegSequenceInputSelector.currentNodeID
         )
@@ -439,6 +496,10 @@ class PerfusionHelperWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         pn.SetParameter(
             "RegistrationStrategy", self.ui.RegistrationStrategyComboBox.currentText
         )
+        pn.SetParameter(
+            "SequenceRegistrationStrategy",
+            self.ui.SequenceRegistrationStrategyComboBox.currentText,
+        )
 
         self._parameterNode.EndModify(wasModified)
 
@@ -447,67 +508,47 @@ class PerfusionHelperWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         seqNode = self.ui.GatherTagsInputSequenceSelector.currentNode()
         if not seqNode:
             slicer.util.errorDisplay("No input sequence selected!")
-
-        errorCode, errorMsg = self.logic.gatherTagsFromDICOMTag(seqNode)
-        if errorCode > 0:
-            slicer.util.errorDisplay(errorMsg)
-            raise Exception(errorMsg)
+        try:
+            self.pipeline.runStage("GatherTags")
+        except Exception as e:
+            slicer.util.errorDisplay(str(e))
+            raise
+        slicer.util.messageBox(
+            "Perfusion tags successfully applied to volume sequence!"
+        )
 
     def onTransferTagsButtonClick(self):
         """Transfer all attributes from source to destination node"""
-        sourceNode = self.ui.TransferTagsInputSequenceSelector.currentNode()
-        destNode = self.ui.TransferTagsDestinationSequenceSelector.currentNode()
-        self.logic.transferTags(sourceNode, destNode)
+        self.pipeline.runStage("TransferTags")
         slicer.util.infoDisplay("Tags successfully transferred!")
 
     def onRunSequenceRegistrationButtonClick(self):
-        """Run sequence registration using "generic rigid (all)" preset"""
-        inputSequence = self.ui.InputRegisteredSequenceSelector.currentNode()
-        outputSequence = self.ui.OutputRegisteredSequenceSelector.currentNode()
-        if outputSequence is None:
-            outSeqName = slicer.mrmlScene.GenerateUniqueName("RegisteredSequence")
-            outputSequence = slicer.mrmlScene.AddNewNodeByClass(
-                "vtkMRMLSequenceNode", outSeqName
-            )
-            self.ui.OutputRegisteredSequenceSelector.setCurrentNode(outputSequence)
-        outputTransformSequence = None  # TODO add selector for this
-        outputs = self.logic.runSequenceRegistration(
-            inputSequence, outputSequence, outputTransformSequence
-        )
+        """Run rigid sequence registration using the selected sequence registration strategy, then
+        transfer tags to the registered sequence"""
+        self.pipeline.runStage("SequenceRegistration")
         # Announce when finished
-        slicer.util.infoDisplay("Sequence registration finished!")
-        # Transfer tags to registered version
-        self.logic.transferTags(inputSequence, outputSequence)
-        # Set the output as the suggested sequence for T1 registration
-        self._parameterNode.SetNodeReferenceID(
-            "T1RegSequenceInput", outputSequence.GetID()
+        slicer.util.infoDisplay(
+            "Sequence registration finished! (reference frame: %i)"
+            % self.pipeline.referenceFrame
         )
+        # Transfer tags to registered version
+        self.pipeline.runStage("TransferTags")
 
     def onRegisterT1ButtonClick(self):
         """Do rigid registration of T1 to current frame of sequence"""
-        T1node = self.ui.T1RegT1Selector.currentNode()
-        seqNode = self.ui.T1RegSequenceInputSelector.currentNode()
-        brainMaskNode = self.ui.T1RegBrainMaskSelector.currentNode()
-        outputTransformNode = self.ui.T1RegOutputTransformSelector.currentNode()
-        strategy = self.ui.RegistrationStrategyComboBox.currentText
-        outputTransformNode = self.logic.registerT1ToSequence(
-            T1node, seqNode, brainMaskNode, outputTransformNode, strategy
-        )
-        # Set output transform node (in case it was just created)
-        self._parameterNode.SetNodeReferenceID(
-            "T1RegTransform", outputTransformNode.GetID()
-        )
-        # Apply transform to T1 node and brain mask
-        T1node.SetAndObserveTransformNodeID(outputTransformNode.GetID())
-        if brainMaskNode:
-            brainMaskNode.SetAndObserveTransformNodeID(outputTransformNode.GetID())
-        # Harden transform if requested
-        if self.ui.HardenTransformCheckBox.checked:
-            T1node.HardenTransform()
-            if brainMaskNode:
-                brainMaskNode.HardenTransform()
+        self.pipeline.runStage("T1Registration")
         self.updateGUIFromParameterNode()
 
+    def onRunPipelineButtonClick(self):
+        """Run all workflow steps whose inputs changed since they were last run"""
+        with slicer.util.tryWithErrorDisplay(
+            "Failed to run the workflow.", waitCursor=True
+        ):
+            results = self.pipeline.run()
+            slicer.util.infoDisplay(
+                "\n".join(["%s: %s" % (stage, result) for stage, result in results])
+            )
+
     def onApplyButton(self):
         """
         VESTIGAL!
@@ -526,6 +567,19 @@ class PerfusionHelperWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 #
 
 
+_sharedLogic = None
+
+
+def getPerfusionHelperLogic():
+    """Return the PerfusionHelperLogic instance shared by the module widget and scripts, so that
+    helper objects cached by the logic (Elastix logic, elastix executable settings) are created once.
+    """
+    global _sharedLogic
+    if _sharedLogic is None:
+        _sharedLogic = PerfusionHelperLogic()
+    return _sharedLogic
+
+
 class PerfusionHelperLogic(ScriptedLoadableModuleLogic):
     """This class should implement all the actual
     computation done by your module.  The interface
@@ -543,6 +597,62 @@ class PerfusionHelperLogic(ScriptedLoadableModuleLogic):
         ScriptedLoadableModuleLogic.__init__(self)
         # Set to delete temporary files created during elastix registration
         self.deleteTempElastixFiles = False  # TODO: change to true when working!
+        # Registration processes (elastix, BRAINSFit) share this many cores (None: all cores),
+        # see RegistrationJobScheduler
+        self.coreBudget = None
+        self.maxConcurrentJobs = None
+        self.pinJobsToCores = False
+        # Decoded per-frame metadata arrays, see getFrameMetadata
+        self._frameMetadataCache = {}
+        # Metadata and legacy attribute values of generated legacy attributes, see
+        # updateLegacyFrameAttributes
+        self._legacyFrameAttributeSources = {}
+        # Sequence processing is chunked to stay within this many bytes (None: 80% of the
+        # memory available when processing starts), see planSequenceProcessing
+        self.memoryBudget = None
+        # Per-frame elastix registration exports and imports this many frames ahead of/behind the
+        # running registrations (None: export all frames of a chunk first), see runFramePipeline
+        self.framePipelineDepth = 2
+        # Stage timing and overlap of the last pipelined registration, see runFramePipeline
+        self.lastFramePipelineStatistics = None
+        # Helper objects of other modules, created on first use
+        self._elastixLogic = None
+        self._elastixExecutable = None
+        self._sequenceRegistrationLogic = None
+
+    def getElastixLogic(self):
+        """Return the Elastix module logic, importing the Elastix module on first use."""
+        if self._elastixLogic is None:
+            try:
+                import Elastix
+            except ImportError:
+                raise Exception(
+                    "The Elastix extension is required for Elastix registration, please install it"
+                )
+            self._elastixLogic = Elastix.ElastixLogic()
+        return self._elastixLogic
+
+    def getElastixExecutable(self):
+        """Return the elastix executable path and the environment to run it in."""
+        if self._elastixExecutable is None:
+            elastixLogic = self.getElastixLogic()
+            self._elastixExecutable = (
+                os.path.join(
+                    elastixLogic.getElastixBinDir(), elastixLogic.elastixFilename
+                ),
+                elastixLogic.getElastixEnv(),
+            )
+        return self._elastixExecutable
+
+    def getSequenceRegistrationLogic(self):
+        """Return the SequenceRegistration module logic, importing the module on first use."""
+        if self._sequenceRegistrationLogic is None:
+            import SequenceRegistration
+
+            self._sequenceRegistrationLogic = (
+                SequenceRegistration.SequenceRegistrationLogic()
+            )
+        return self._sequenceRegistrationLogic
 
     def setDefaultParameters(self, parameterNode):
         """
@@ -550,6 +660,10 @@ class PerfusionHelperLogic(ScriptedLoadableModuleLogic):
         """
         if not parameterNode.GetParameter("RegistrationStrategy"):
             parameterNode.SetParameter("RegistrationStrategy", "BRAINS")
+        if not parameterNode.GetParameter("SequenceRegistrationStrategy"):
+            parameterNode.SetParameter("SequenceRegistrationStrategy", "Elastix")
+        if not parameterNode.GetParameter("AutoReferenceFrameChecked"):
+            parameterNode.SetParameter("AutoReferenceFrameChecked", "1")
         # if not parameterNode.GetParameter("Threshold"):
         #     parameterNode.SetParameter("Threshold", "100.0")
         # if not parameterNode.GetParameter("Invert"):
@@ -557,24 +671,629 @@ class PerfusionHelperLogic(ScriptedLoadableModuleLogic):
         pass
 
     def runSequenceRegistration(
-        self, inputSequence, outputSequence, outputTransformSequence=None
+        self,
+        inputSequence,
+        outputSequence,
+        outputTransformSequence=None,
+        strategy="Elastix",
+        fixedVolumeItemNumber=0,
+        fixedVolumeMaskNode=None,
+        createBrainMask=False,
     ):
-        """ """
-        generic_rigid_preset_idx = 1
-        import SequenceRegistration
+        """Register every frame of inputSequence to frame fixedVolumeItemNumber (see
+        selectReferenceFrame for choosing a good one). The "Elastix" strategy uses the
+        SequenceRegistration module's "generic rigid (all)" preset, the "BRAINS" strategy runs
+        concurrent BRAINSFit jobs (see runBrainsSequenceRegistration).
+        If fixedVolumeMaskNode is given (or created from the fixed frame with createBrainMask, see
+        createBrainMaskFromVolume), registrations only sample the fixed frame inside the mask,
+        which excludes neck, air and fat-shifted regions. Masked Elastix registration is run frame
+        by frame (see runElastixSequenceRegistration), because SequenceRegistration has no masks; it
+        uses the same preset parameters with fewer spatial samples, and cubic interpolation to
+        resample the frames like the preset's B-spline resampling.
+        Frames are processed in chunks and with as many parallel jobs as fit in the memory budget
+        (see planSequenceProcessing), so large sequences are processed more slowly instead of
+        running out of memory.
+        """
+        if createBrainMask and fixedVolumeMaskNode is None:
+            fixedVolumeMaskNode = self.createBrainMaskFromVolume(
+                inputSequence.GetNthDataNode(fixedVolumeItemNumber),
+                inputSequence.GetName() + "_BrainMask",
+            )
+        if strategy == "BRAINS":
+            plan = self.planSequenceProcessing(
+                inputSequence,
+                numberOfWorkers=self.createJobScheduler().maxConcurrentJobs,
+                outputDtype="float32",
+            )
+            self.runBrainsSequenceRegistration(
+                inputSequence,
+                outputSequence,
+                outputTransformSequence,
+                fixedVolumeItemNumber=fixedVolumeItemNumber,
+                maxConcurrentJobs=plan["numberOfWorkers"],
+                chunkSize=plan["chunkSize"],
+                fixedVolumeMaskNode=fixedVolumeMaskNode,
+            )
+            return
+        if fixedVolumeMaskNode is not None:
+            plan = self.planSequenceProcessing(
+                inputSequence,
+                numberOfWorkers=self.createJobScheduler().maxConcurrentJobs,
+            )
+            # With framePipelineDepth set (default: 2) frames are pipelined and the planned
+            # chunkSize is not used; only pipelineDepth plus the number of workers frames are
+            # exported at a time, which is fewer than a planned chunk.
+            self.runElastixSequenceRegistration(
+                inputSequence,
+                outputSequence,
+                outputTransformSequence,
+                fixedVolumeItemNumber=fixedVolumeItemNumber,
+                fixedVolumeMaskNode=fixedVolumeMaskNode,
+                maxConcurrentJobs=plan["numberOfWorkers"],
+                chunkSize=plan["chunkSize"],
+                pipelineDepth=self.framePipelineDepth,
+            )
+            return
+        # SequenceRegistration registers one frame at a time
+        plan = self.planSequenceProcessing(inputSequence, numberOfWorkers=1)
+        generic_rigid_preset_idx = self.SEQUENCE_REGISTRATION_PRESET_INDEX
+        seqRegLogic = self.getSequenceRegistrationLogic()
+        numberOfFrames = inputSequence.GetNumberOfDataNodes()
+        if plan["chunkSize"] >= numberOfFrames:
+            seqRegLogic.registerVolumeSequence(
+                inputSequence,
+                outputSequence,
+                outputTransformSequence,
+                fixedVolumeItemNumber=fixedVolumeItemNumber,
+                computeMovingToFixedTransform=True,
+                presetIndex=generic_rigid_preset_idx,
+                startFrameIndex=0,
+                endFrameIndex=None,
+            )
+            return
+        # SequenceRegistration clears its output sequences, so register each chunk into temporary
+        # sequences and move the results to the output before starting the next chunk
+        self.initializeOutputSequences(
+            inputSequence, [outputSequence, outputTransformSequence]
+        )
+        chunkOutputSequence = slicer.vtkMRMLSequenceNode()
+        chunkTransformSequence = (
+            slicer.vtkMRMLSequenceNode() if outputTransformSequence else None
+        )
+        for startFrameIndex in range(0, numberOfFrames, plan["chunkSize"]):
+            endFrameIndex = min(startFrameIndex + plan["chunkSize"], numberOfFrames) - 1
+            self.addLog(
+                "Registering frames %i-%i of %i"
+                % (startFrameIndex, endFrameIndex, numberOfFrames)
+            )
+            seqRegLogic.registerVolumeSequence(
+                inputSequence,
+                chunkOutputSequence,
+                chunkTransformSequence,
+                fixedVolumeItemNumber=fixedVolumeItemNumber,
+                computeMovingToFixedTransform=True,
+                presetIndex=generic_rigid_preset_idx,
+                startFrameIndex=startFrameIndex,
+                endFrameIndex=endFrameIndex,
+            )
+            for chunkSequence, sequence in [
+                (chunkOutputSequence, outputSequence),
+                (chunkTransformSequence, outputTransformSequence),
+            ]:
+                if chunkSequence is None:
+                    continue
+                for itemNumber in range(chunkSequence.GetNumberOfDataNodes()):
+                    sequence.SetDataNodeAtValue(
+                        chunkSequence.GetNthDataNode(itemNumber),
+                        chunkSequence.GetNthIndexValue(itemNumber),
+                    )
+                chunkSequence.RemoveAllDataNodes()
 
-        seqRegLogic = SequenceRegistration.SequenceRegistrationLogic()
-        seqRegLogic.registerVolumeSequence(
-            inputSequence,
-            outputSequence,
-            outputTransformSequence,
-            fixedVolumeItemNumber=0,
-            computeMovingToFixedTransform=True,
-            presetIndex=generic_rigid_preset_idx,
-            startFrameIndex=0,
-            endFrameIndex=None,
+    def runElastixSequenceRegistration(
+        self,
+        inputSequence,
+        outputSequence,
+        outputTransformSequence=None,
+        fixedVolumeItemNumber=0,
+        fixedVolumeMaskNode=None,
+        maxConcurrentJobs=None,
+        chunkSize=None,
+        pipelineDepth=None,
+    ):
+        """Register every frame of inputSequence to frame fixedVolumeItemNumber with concurrent
+        elastix runs (see RegistrationJobScheduler), using the same elastix preset as unmasked
+        sequence registration (see writeSequenceRegistrationParameterFiles). The fixed frame, the
+        optional fixed mask and the parameter files are written once and shared by all frames. With
+        a mask, elastix draws its samples only inside the mask, so fewer samples are needed. Frames
+        are resampled onto the fixed frame grid with cubic interpolation and written to
+        outputSequence, moving-to-fixed transforms to outputTransformSequence. Frames are exported chunkSize frames at a time (default: all).
+        If pipelineDepth is set, frames are instead exported and imported while the registrations
+        of other frames are running (see runFramePipeline), and chunkSize is ignored.
+        """
+        numberOfFrames = inputSequence.GetNumberOfDataNodes()
+        self.initializeOutputSequences(
+            inputSequence, [outputSequence, outputTransformSequence]
         )
-        pass
+        fixedFrame = inputSequence.GetNthDataNode(fixedVolumeItemNumber)
+        tempDir = self.getElastixLogic().createTempDirectory()
+        self.addLog("Sequence registration is started in working directory: " + tempDir)
+        inputDir = os.path.join(tempDir, "input")
+        os.makedirs(inputDir, exist_ok=True)
+        fixedArguments = []
+        for parameterFilePath in self.writeSequenceRegistrationParameterFiles(
+            inputDir, numberOfSpatialSamples=2000 if fixedVolumeMaskNode else None
+        ):
+            fixedArguments += ["-p", parameterFilePath]
+        for volumeNode, fileName, paramName in [
+            (fixedFrame, "fixed.mhd", "-f"),
+            (fixedVolumeMaskNode, "fixedMask.mhd", "-fMask"),
+        ]:
+            if volumeNode is None:
+                continue
+            filePath = os.path.join(inputDir, fileName)
+            self.exportVolumeForElastix(volumeNode, filePath)
+            fixedArguments += [paramName, filePath]
+        # The fixed frame is already registered to itself
+        fixedIndexValue = inputSequence.GetNthIndexValue(fixedVolumeItemNumber)
+        outputSequence.SetDataNodeAtValue(fixedFrame, fixedIndexValue)
+        if outputTransformSequence is not None:
+            outputTransformSequence.SetDataNodeAtValue(
+                slicer.vtkMRMLLinearTransformNode(), fixedIndexValue
+            )
+
+        elastixExecutablePath, elastixEnv = self.getElastixExecutable()
+        scheduler = self.createJobScheduler(maxConcurrentJobs)
+
+        def collectFrame(itemNumber, frameDir):
+            movingFrame = inputSequence.GetNthDataNode(itemNumber)
+            indexValue = inputSequence.GetNthIndexValue(itemNumber)
+            transformNode = slicer.vtkMRMLLinearTransformNode()
+            self.importElastixTransform(
+                os.path.join(frameDir, "result-transform"), transformNode
+            )
+            transformFromParent = vtk.vtkMatrix4x4()
+            transformNode.GetMatrixTransformFromParent(transformFromParent)
+            transformMatrix = slicer.util.arrayFromVTKMatrix(transformFromParent)
+            registeredFrame = slicer.vtkMRMLScalarVolumeNode()
+            self.resampleVolume(
+                movingFrame,
+                fixedFrame,
+                transformMatrix,
+                registeredFrame,
+                interpolationMode="cubic",
+            )
+            outputSequence.SetDataNodeAtValue(registeredFrame, indexValue)
+            if outputTransformSequence is not None:
+                outputTransformSequence.SetDataNodeAtValue(transformNode, indexValue)
+
+        def createFrameJob(itemNumber, onFinished=None):
+            frameDir = os.path.join(tempDir, "frame%04i" % itemNumber)
+            os.makedirs(os.path.join(frameDir, "result-transform"))
+            movingFilePath = os.path.join(frameDir, "moving.mhd")
+            self.exportVolumeForElastix(
+                inputSequence.GetNthDataNode(itemNumber), movingFilePath
+            )
+            return ElastixRegistrationJob(
+                elastixExecutablePath,
+                fixedArguments + ["-m", movingFilePath, "-out", "result-transform"],
+                env=elastixEnv,
+                logFilePath=os.path.join(frameDir, "elastix_output.txt"),
+                workingDirectory=frameDir,
+                onFinished=onFinished,
+            )
+
+        def removeExportedFrame(itemNumber):
+            if self.deleteTempElastixFiles:
+                frameDir = os.path.join(tempDir, "frame%04i" % itemNumber)
+                os.remove(os.path.join(frameDir, "moving.mhd"))
+                os.remove(os.path.join(frameDir, "moving.raw"))
+
+        itemNumbers = [
+            itemNumber
+            for itemNumber in range(numberOfFrames)
+            if itemNumber != fixedVolumeItemNumber
+        ]
+        if pipelineDepth:
+
+            def importFrame(itemNumber):
+                collectFrame(itemNumber, os.path.join(tempDir, "frame%04i" % itemNumber))
+                removeExportedFrame(itemNumber)
+
+            self.runFramePipeline(
+                scheduler, itemNumbers, createFrameJob, importFrame, pipelineDepth
+            )
+        else:
+            chunkSize = max(1, chunkSize or len(itemNumbers))
+            for chunkStart in range(0, len(itemNumbers), chunkSize):
+                for itemNumber in itemNumbers[chunkStart : chunkStart + chunkSize]:
+                    scheduler.submit(
+                        createFrameJob(
+                            itemNumber,
+                            onFinished=lambda job, itemNumber=itemNumber: collectFrame(
+                                itemNumber,
+                                os.path.join(tempDir, "frame%04i" % itemNumber),
+                            ),
+                        )
+                    )
+                scheduler.runUntilDone()
+                # Exported frames of this chunk are not needed anymore
+                for itemNumber in itemNumbers[chunkStart : chunkStart + chunkSize]:
+                    removeExportedFrame(itemNumber)
+        if self.deleteTempElastixFiles:
+            import shutil
+
+            shutil.rmtree(tempDir)
+
+    def runFramePipeline(
+        self, scheduler, itemNumbers, createFrameJob, importFrame, pipelineDepth=2
+    ):
+        """Run one registration job per frame so that exporting and importing overlap with the
+        registrations: while frame i is being registered, frame i+1 is exported and the result of
+        frame i-1 is imported. createFrameJob(itemNumber, onFinished) exports the frame and returns
+        its job, importFrame(itemNumber) imports its result; both run in the main thread, because
+        they use MRML and VTK. At most pipelineDepth exported frames wait for a free core. No job is
+        started while pipelineDepth finished frames wait for import, so fewer than pipelineDepth plus
+        the number of concurrent jobs frames wait for import. Returns the stage statistics (see
+        summarizeFramePipeline), which are also stored in lastFramePipelineStatistics.
+        """
+        import collections
+        import time
+
+        framesToExport = collections.deque(itemNumbers)
+        framesToImport = collections.deque()
+        submittedJobs = []
+        exportIntervals = []
+        importIntervals = []
+        maxQueuedJobs = 0
+        maxQueuedImports = 0
+        startTime = time.perf_counter()
+        while framesToExport or framesToImport or scheduler.hasJobs():
+            # Keep the cores busy first (unless imports fall behind), then drain finished frames
+            # before exporting more
+            if len(framesToImport) < pipelineDepth:
+                scheduler.startQueuedJobs(numberOfUpcomingJobs=len(framesToExport))
+            scheduler.pollJobs()
+            maxQueuedImports = max(maxQueuedImports, len(framesToImport))
+            if framesToImport:
+                itemNumber = framesToImport.popleft()
+                intervalStart = time.perf_counter()
+                importFrame(itemNumber)
+                importIntervals.append((intervalStart, time.perf_counter()))
+            elif framesToExport and scheduler.numberOfQueuedJobs() < pipelineDepth:
+                itemNumber = framesToExport.popleft()
+                intervalStart = time.perf_counter()
+                job = createFrameJob(
+                    itemNumber,
+                    onFinished=lambda job, itemNumber=itemNumber: framesToImport.append(
+                        itemNumber
+                    ),
+                )
+                exportIntervals.append((intervalStart, time.perf_counter()))
+                scheduler.submit(job)
+                submittedJobs.append(job)
+                maxQueuedJobs = max(maxQueuedJobs, scheduler.numberOfQueuedJobs())
+            else:
+                time.sleep(0.01)
+        statistics = self.summarizeFramePipeline(
+            time.perf_counter() - startTime,
+            exportIntervals,
+            [(job.startTime, job.finishTime) for job in submittedJobs],
+            importIntervals,
+        )
+        statistics["maxQueuedExports"] = maxQueuedJobs
+        statistics["maxQueuedImports"] = maxQueuedImports
+        self.lastFramePipelineStatistics = statistics
+        self.addLog(
+            "Frame pipeline: %.1fs wall time, export %.1fs, registration %.1fs, import %.1fs, "
+            "%.0f%% of export and import overlapped with registration"
+            % (
+                statistics["wallTime"],
+                statistics["exportTime"],
+                statistics["registrationBusyTime"],
+                statistics["importTime"],
+                100 * statistics["overlapFraction"],
+            )
+        )
+        return statistics
+
+    def summarizeFramePipeline(
+        self, wallTime, exportIntervals, registrationIntervals, importIntervals
+    ):
+        """Compute how much time the stages of a frame pipeline took and how much of the export and
+        import time was hidden behind running registrations. Intervals are (start, end) pairs of
+        time.perf_counter() values."""
+        # Merge registration intervals into the periods when at least one registration was running
+        busyPeriods = []
+        for start, end in sorted(registrationIntervals):
+            if busyPeriods and start <= busyPeriods[-1][1]:
+                busyPeriods[-1][1] = max(busyPeriods[-1][1], end)
+            else:
+                busyPeriods.append([start, end])
+        mainThreadIntervals = exportIntervals + importIntervals
+        overlappedTime = sum(
+            max(0.0, min(end, busyEnd) - max(start, busyStart))
+            for start, end in mainThreadIntervals
+            for busyStart, busyEnd in busyPeriods
+        )
+        mainThreadTime = sum(end - start for start, end in mainThreadIntervals)
+        return {
+            "wallTime": wallTime,
+            "exportTime": sum(end - start for start, end in exportIntervals),
+            "importTime": sum(end - start for start, end in importIntervals),
+            "registrationTime": sum(end - start for start, end in registrationIntervals),
+            "registrationBusyTime": sum(end - start for start, end in busyPeriods),
+            "overlappedTime": overlappedTime,
+            "overlapFraction": overlappedTime / mainThreadTime if mainThreadTime else 0.0,
+        }
+
+    def resampleVolume(
+        self,
+        movingVolumeNode,
+        referenceVolumeNode,
+        transformFromParentMatrix,
+        outputVolumeNode,
+        interpolationMode="linear",
+    ):
+        """Resample movingVolumeNode onto the voxel grid of referenceVolumeNode with "linear" or
+        "cubic" interpolation and store the result in outputVolumeNode. transformFromParentMatrix (4x4
+        numpy array) maps reference RAS coordinates to moving RAS coordinates, as registration
+        results do. Works on volume nodes that are not in the scene.
+        """
+        referenceIJKToRAS = vtk.vtkMatrix4x4()
+        referenceVolumeNode.GetIJKToRASMatrix(referenceIJKToRAS)
+        movingRASToIJK = vtk.vtkMatrix4x4()
+        movingVolumeNode.GetRASToIJKMatrix(movingRASToIJK)
+        # Reference IJK -> reference RAS -> moving RAS -> moving IJK
+        resliceAxes = (
+            slicer.util.arrayFromVTKMatrix(movingRASToIJK)
+            @ transformFromParentMatrix
+            @ slicer.util.arrayFromVTKMatrix(referenceIJKToRAS)
+        )
+        reslice = vtk.vtkImageReslice()
+        reslice.SetInputData(movingVolumeNode.GetImageData())
+        reslice.SetResliceAxes(slicer.util.vtkMatrixFromArray(resliceAxes))
+        if interpolationMode == "cubic":
+            reslice.SetInterpolationModeToCubic()
+        else:
+            reslice.SetInterpolationModeToLinear()
+        reslice.SetBackgroundLevel(0)
+        # Slicer keeps the volume geometry in the node, image data has unit spacing and zero origin
+        reslice.SetOutputExtent(referenceVolumeNode.GetImageData().GetExtent())
+        reslice.SetOutputSpacing(1, 1, 1)
+        reslice.SetOutputOrigin(0, 0, 0)
+        reslice.Update()
+        outputVolumeNode.CopyOrientation(referenceVolumeNode)
+        outputVolumeNode.SetAndObserveImageData(reslice.GetOutput())
+
+    def computeOtsuThreshold(self, values, numberOfBins=256):
+        """Return the threshold that maximizes the between-class variance of values (Otsu's method)."""
+        import numpy as np
+
+        histogram, binEdges = np.histogram(values, bins=numberOfBins)
+        binCenters = (binEdges[:-1] + binEdges[1:]) / 2
+        weightBelow = np.cumsum(histogram)
+        weightAbove = weightBelow[-1] - weightBelow
+        sumBelow = np.cumsum(histogram * binCenters)
+        meanBelow = sumBelow / np.maximum(weightBelow, 1)
+        meanAbove = (sumBelow[-1] - sumBelow) / np.maximum(weightAbove, 1)
+        betweenClassVariance = weightBelow * weightAbove * (meanBelow - meanAbove) ** 2
+        return binCenters[np.argmax(betweenClassVariance)]
+
+    def createBrainMaskFromVolume(self, volumeNode, maskName="BrainMask"):
+        """Create a rough brain mask labelmap (value 1) from a T2*-weighted volume, such as the
+        reference frame of a DSC sequence: Otsu threshold, erosion to cut thin bridges to scalp and
+        neck, largest connected region, dilation back, and closing to fill holes such as ventricles.
+        The mask is added to the scene so that it can be reviewed and edited.
+        """
+        threshold = self.computeOtsuThreshold(slicer.util.arrayFromVolume(volumeNode))
+        thresholdFilter = vtk.vtkImageThreshold()
+        thresholdFilter.SetInputData(volumeNode.GetImageData())
+        thresholdFilter.ThresholdByUpper(threshold)
+        thresholdFilter.SetInValue(1)
+        thresholdFilter.SetOutValue(0)
+        thresholdFilter.SetOutputScalarTypeToUnsignedChar()
+        # Perfusion volumes usually have thick slices, so do not grow across slices
+        erodeFilter = vtk.vtkImageDilateErode3D()
+        erodeFilter.SetInputConnection(thresholdFilter.GetOutputPort())
+        erodeFilter.SetDilateValue(0)
+        erodeFilter.SetErodeValue(1)
+        erodeFilter.SetKernelSize(5, 5, 1)
+        connectivityFilter = vtk.vtkImageConnectivityFilter()
+        connectivityFilter.SetInputConnection(erodeFilter.GetOutputPort())
+        connectivityFilter.SetScalarRange(1, 1)
+        connectivityFilter.SetExtractionModeToLargestRegion()
+        connectivityFilter.SetLabelModeToConstantValue()
+        connectivityFilter.SetLabelConstantValue(1)
+        connectivityFilter.SetLabelScalarTypeToUnsignedChar()
+        dilateFilter = vtk.vtkImageDilateErode3D()
+        dilateFilter.SetInputConnection(connectivityFilter.GetOutputPort())
+        dilateFilter.SetDilateValue(1)
+        dilateFilter.SetErodeValue(0)
+        dilateFilter.SetKernelSize(9, 9, 1)
+        closeFilter = vtk.vtkImageDilateErode3D()
+        closeFilter.SetInputConnection(dilateFilter.GetOutputPort())
+        closeFilter.SetDilateValue(0)
+        closeFilter.SetErodeValue(1)
+        closeFilter.SetKernelSize(5, 5, 1)
+        closeFilter.Update()
+        maskNode = self.newNode("vtkMRMLLabelMapVolumeNode", maskName)
+        maskNode.CopyOrientation(volumeNode)
+        maskNode.SetAndObserveImageData(closeFilter.GetOutput())
+        return maskNode
+
+    def initializeOutputSequences(self, inputSequence, outputSequences):
+        """Clear each (not None) sequence of outputSequences and give it the index of inputSequence."""
+        for seq in outputSequences:
+            if seq is None:
+                continue
+            seq.RemoveAllDataNodes()
+            seq.SetIndexName(inputSequence.GetIndexName())
+            seq.SetIndexUnit(inputSequence.GetIndexUnit())
+            seq.SetIndexType(inputSequence.GetIndexType())
+
+    def getAvailableMemory(self):
+        """Return the physical memory available for new allocations in bytes (None if unknown)."""
+        import sys
+
+        if sys.platform == "win32":
+            import ctypes
+
+            class MEMORYSTATUSEX(ctypes.Structure):
+                _fields_ = [
+                    ("dwLength", ctypes.c_ulong),
+                    ("dwMemoryLoad", ctypes.c_ulong),
+                    ("ullTotalPhys", ctypes.c_ulonglong),
+                    ("ullAvailPhys", ctypes.c_ulonglong),
+                    ("ullTotalPageFile", ctypes.c_ulonglong),
+                    ("ullAvailPageFile", ctypes.c_ulonglong),
+                    ("ullTotalVirtual", ctypes.c_ulonglong),
+                    ("ullAvailVirtual", ctypes.c_ulonglong),
+                    ("sullAvailExtendedVirtual", ctypes.c_ulonglong),
+                ]
+
+            memoryStatus = MEMORYSTATUSEX()
+            memoryStatus.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+            if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(memoryStatus)):
+                return memoryStatus.ullAvailPhys
+            return None
+        # MemAvailable also counts reclaimable page cache, unlike free pages
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        try:
+            return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (ValueError, OSError, AttributeError):
+            return None
+
+    def estimateSequenceProcessingMemory(
+        self,
+        frameDimensions,
+        dtype,
+        numberOfFrames,
+        numberOfWorkers=1,
+        chunkSize=None,
+        outputDtype=None,
+        includeInput=True,
+    ):
+        """Estimate the memory (in bytes) used by registering a sequence of numberOfFrames frames of
+        frameDimensions voxels of type dtype (numpy dtype or name), chunkSize frames at a time with
+        numberOfWorkers concurrent registrations. outputDtype is the type of the registered frames
+        (default: dtype). Without includeInput, the already loaded input sequence is left out.
+        Returns a dictionary with the parts of the estimate and their sum ("peak"):
+        - sequences: input sequence (if includeInput) and the complete output sequence
+        - chunk: scene copies of the input and registered frames of the current chunk
+        - workers: registration processes, each holding fixed and moving images as float at
+          every resolution level of the smoothing image pyramid, and the resampled output
+        """
+        import numpy as np
+
+        numberOfVoxels = int(np.prod(frameDimensions))
+        inputFrameBytes = numberOfVoxels * np.dtype(dtype).itemsize
+        outputFrameBytes = numberOfVoxels * np.dtype(outputDtype or dtype).itemsize
+        if chunkSize is None:
+            chunkSize = numberOfFrames
+        chunkSize = max(1, min(chunkSize, numberOfFrames))
+        numberOfWorkers = max(1, min(numberOfWorkers, chunkSize))
+        pyramidLevels = 6  # NumberOfResolutions in createElastixParameterFile
+        estimate = {
+            "sequences": numberOfFrames
+            * ((inputFrameBytes if includeInput else 0) + outputFrameBytes),
+            # The fixed frame is copied once for all chunks
+            "chunk": (chunkSize + 1) * (inputFrameBytes + outputFrameBytes),
+            "workers": numberOfWorkers
+            * (2 * numberOfVoxels * 4 * pyramidLevels + outputFrameBytes),
+        }
+        estimate["peak"] = sum(estimate.values())
+        return estimate
+
+    def planSequenceProcessing(
+        self, inputSequence, numberOfWorkers=1, memoryBudget=None, outputDtype=None
+    ):
+        """Choose the chunk size and number of concurrent registrations for processing
+        inputSequence within memoryBudget bytes (default: the memoryBudget attribute, or 80% of the
+        available memory, which does not count the already loaded input sequence). The most workers
+        that fit (up to numberOfWorkers) are used, with the largest chunk that fits next to them.
+        Returns a dictionary with chunkSize, numberOfWorkers, estimatedPeakMemory and memoryBudget.
+        If even one frame at a time does not fit, a warning is logged and frames are processed one
+        at a time by one worker.
+        """
+        from vtk.util import numpy_support
+
+        if memoryBudget is None:
+            memoryBudget = self.memoryBudget
+        # An explicit budget covers all processing memory, available memory is what is left next
+        # to the loaded input
+        includeInput = memoryBudget is not None
+        if memoryBudget is None:
+            availableMemory = self.getAvailableMemory()
+            memoryBudget = (
+                int(availableMemory * 0.8) if availableMemory is not None else None
+            )
+        numberOfFrames = inputSequence.GetNumberOfDataNodes()
+        imageData = inputSequence.GetNthDataNode(0).GetImageData()
+        frameDimensions = list(imageData.GetDimensions()) + [
+            imageData.GetNumberOfScalarComponents()
+        ]
+        dtype = numpy_support.get_numpy_array_type(imageData.GetScalarType())
+        numberOfWorkers = max(1, min(numberOfWorkers, numberOfFrames))
+
+        def estimatePeak(workers, chunkSize):
+            return self.estimateSequenceProcessingMemory(
+                frameDimensions,
+                dtype,
+                numberOfFrames,
+                workers,
+                chunkSize,
+                outputDtype,
+                includeInput=includeInput,
+            )["peak"]
+
+        if memoryBudget is None:
+            # Memory cannot be checked, process everything at once
+            return {
+                "chunkSize": numberOfFrames,
+                "numberOfWorkers": numberOfWorkers,
+                "estimatedPeakMemory": estimatePeak(numberOfWorkers, numberOfFrames),
+                "memoryBudget": None,
+            }
+        for workers in range(numberOfWorkers, 0, -1):
+            if estimatePeak(workers, workers) > memoryBudget:
+                continue
+            # Largest chunk that fits (the estimate grows linearly with the chunk size)
+            chunkSize = workers
+            while (
+                chunkSize < numberOfFrames
+                and estimatePeak(workers, chunkSize + 1) <= memoryBudget
+            ):
+                chunkSize += 1
+            plan = {
+                "chunkSize": chunkSize,
+                "numberOfWorkers": workers,
+                "estimatedPeakMemory": estimatePeak(workers, chunkSize),
+                "memoryBudget": memoryBudget,
+            }
+            logging.info("Sequence processing plan: %s" % plan)
+            return plan
+        plan = {
+            "chunkSize": 1,
+            "numberOfWorkers": 1,
+            "estimatedPeakMemory": estimatePeak(1, 1),
+            "memoryBudget": memoryBudget,
+        }
+        logging.warning(
+            "Processing %s needs about %.1f GB of memory, but only %.1f GB are available,"
+            " processing one frame at a time"
+            % (
+                inputSequence.GetName(),
+                plan["estimatedPeakMemory"] / 1e9,
+                memoryBudget / 1e9,
+            )
+        )
+        return plan
 
     def registerT1ToSequence(
         self, T1node, seqNode, brainMaskNode, outputTransformNode, strategy
@@ -601,10 +1320,140 @@ class PerfusionHelperLogic(ScriptedLoadableModuleLogic):
             )
         return outputTransformNode
 
+    # Attribute name prefix of per-frame metadata arrays (see setFrameMetadata)
+    FRAME_METADATA_ATTRIBUTE_PREFIX = "PerfusionHelper.FrameMetadata."
+    # Legacy space-separated attributes that are generated from per-frame metadata arrays
+    # (see updateLegacyFrameAttributes), attribute name -> (metadata name, value format)
+    LEGACY_FRAME_ATTRIBUTES = {"MultiVolume.FrameLabels": ("FrameTimes", "%i")}
+
+    def setFrameMetadata(self, seqNode, name, values):
+        """Store a per-frame metadata array (such as "FrameTimes" in ms) on seqNode. The values are
+        kept in binary form (base64-encoded, so that they are saved with the scene as a node
+        attribute) and can be read back as a numpy array without any text parsing, see
+        getFrameMetadata.
+        """
+        import base64
+        import numpy as np
+
+        values = np.ascontiguousarray(values)
+        attributeValue = "%s:%s" % (
+            values.dtype.str,
+            base64.b64encode(values.tobytes()).decode("ascii"),
+        )
+        seqNode.SetAttribute(self.FRAME_METADATA_ATTRIBUTE_PREFIX + name, attributeValue)
+        values = values.copy()
+        values.flags.writeable = False
+        self._frameMetadataCache[self._frameMetadataCacheKey(seqNode, name)] = (
+            seqNode.GetMTime(),
+            attributeValue,
+            values,
+        )
+
+    def getFrameMetadata(self, seqNode, name):
+        """Return the per-frame metadata array stored by setFrameMetadata (read-only numpy array),
+        or None if there is none. Decoded arrays are cached until the node is modified.
+        For sequences tagged before metadata arrays were introduced, "FrameTimes" is parsed from
+        the legacy MultiVolume.FrameLabels attribute.
+        """
+        import base64
+        import numpy as np
+
+        cacheKey = self._frameMetadataCacheKey(seqNode, name)
+        cached = self._frameMetadataCache.get(cacheKey)
+        if cached and cached[0] == seqNode.GetMTime():
+            return cached[2]
+        attributeValue = seqNode.GetAttribute(self.FRAME_METADATA_ATTRIBUTE_PREFIX + name)
+        if attributeValue is None:
+            for legacyName, (metadataName, valueFormat) in self.LEGACY_FRAME_ATTRIBUTES.items():
+                legacyValue = seqNode.GetAttribute(legacyName)
+                if metadataName == name and legacyValue:
+                    return np.array(legacyValue.split(), dtype=np.float64)
+            return None
+        if cached and cached[1] == attributeValue:
+            # Node was modified, but not this attribute
+            values = cached[2]
+        else:
+            dtypeStr, encodedValues = attributeValue.split(":", 1)
+            values = np.frombuffer(
+                base64.b64decode(encodedValues), dtype=np.dtype(dtypeStr)
+            )
+        self._frameMetadataCache[cacheKey] = (seqNode.GetMTime(), attributeValue, values)
+        return values
+
+    def getFrameMetadataNames(self, seqNode):
+        prefix = self.FRAME_METADATA_ATTRIBUTE_PREFIX
+        return [
+            attrName[len(prefix) :]
+            for attrName in seqNode.GetAttributeNames()
+            if attrName.startswith(prefix)
+        ]
+
+    def _frameMetadataCacheKey(self, seqNode, name):
+        return (seqNode.GetID() or id(seqNode), name)
+
+    def updateLegacyFrameAttributes(self, seqNode):
+        """Generate the space-separated per-frame attributes read by other modules (such as
+        MultiVolume.FrameLabels for DSCMRIAnalysis) from the per-frame metadata arrays. Tag
+        operations do not generate them, call this when handing a sequence to such a module. A
+        string is only generated again if its metadata array (or the string itself) changed since
+        it was last generated.
+        """
+        for legacyName, (metadataName, valueFormat) in self.LEGACY_FRAME_ATTRIBUTES.items():
+            metadataValue = seqNode.GetAttribute(
+                self.FRAME_METADATA_ATTRIBUTE_PREFIX + metadataName
+            )
+            if not metadataValue:
+                continue
+            sourceKey = self._frameMetadataCacheKey(seqNode, legacyName)
+            if self._legacyFrameAttributeSources.get(sourceKey) == (
+                metadataValue,
+                seqNode.GetAttribute(legacyName),
+            ):
+                continue
+            values = self.getFrameMetadata(seqNode, metadataName)
+            legacyValue = " ".join([valueFormat % value for value in values])
+            if seqNode.GetAttribute(legacyName) != legacyValue:
+                seqNode.SetAttribute(legacyName, legacyValue)
+            self._legacyFrameAttributeSources[sourceKey] = (metadataValue, legacyValue)
+
+    def applyT1RegistrationTransform(
+        self, T1node, brainMaskNode, transformNode, harden=False
+    ):
+        """Apply the T1 registration transform to the T1 volume and its brain mask (if any),
+        and harden it if requested."""
+        T1node.SetAndObserveTransformNodeID(transformNode.GetID())
+        if brainMaskNode:
+            brainMaskNode.SetAndObserveTransformNodeID(transformNode.GetID())
+        if harden:
+            T1node.HardenTransform()
+            if brainMaskNode:
+                brainMaskNode.HardenTransform()
+
     def transferTags(self, sourceNode, destNode):
-        """Transfer all attributes from source node to destination node"""
+        """Transfer all attributes from source node to destination node. Per-frame metadata is
+        copied in its compact binary form (and its decoded arrays are shared), legacy per-frame
+        attributes that can be generated from it are not copied and removed from the destination
+        (see updateLegacyFrameAttributes).
+        """
+        generatedAttributes = [
+            legacyName
+            for legacyName, (metadataName, valueFormat) in self.LEGACY_FRAME_ATTRIBUTES.items()
+            if sourceNode.GetAttribute(self.FRAME_METADATA_ATTRIBUTE_PREFIX + metadataName)
+        ]
+        for attrName in generatedAttributes:
+            if destNode.GetAttribute(attrName) is not None:
+                destNode.RemoveAttribute(attrName)
         for attrName in sourceNode.GetAttributeNames():
+            if attrName in generatedAttributes:
+                continue
             destNode.SetAttribute(attrName, sourceNode.GetAttribute(attrName))
+        for name in self.getFrameMetadataNames(sourceNode):
+            values = self.getFrameMetadata(sourceNode, name)
+            self._frameMetadataCache[self._frameMetadataCacheKey(destNode, name)] = (
+                destNode.GetMTime(),
+                sourceNode.GetAttribute(self.FRAME_METADATA_ATTRIBUTE_PREFIX + name),
+                values,
+            )
 
     def gatherTagsFromDICOMTag(self, inputSequenceNode):
         """
@@ -639,28 +1488,30 @@ class PerfusionHelperLogic(ScriptedLoadableModuleLogic):
         # Gather needed parameters
         echoTime = ds.EchoTime
         flipAngle = ds.FlipAngle
-        repetitionTime = ds.RepetitionTime
-        # Make list of needed frame labels
-        frameLabels = " ".join(
-            [
-                "%i" % (idx * repetitionTime)
-                for idx in range(seqNode.GetNumberOfDataNodes())
-            ]
+        repetitionTime = float(ds.RepetitionTime)
+        # Per-frame timing is stored as arrays, MultiVolume.FrameLabels is only generated when
+        # needed (see updateLegacyFrameAttributes)
+        import numpy as np
+
+        numberOfFrames = seqNode.GetNumberOfDataNodes()
+        self.setFrameMetadata(
+            seqNode, "FrameTimes", np.arange(numberOfFrames) * repetitionTime
+        )
+        self.setFrameMetadata(
+            seqNode, "RepetitionTime", np.full(numberOfFrames, repetitionTime)
         )
         # Add attributes to Sequence node (note that conversion is necessary from pydicom output to regular strings)
         seqNode.SetAttribute("MultiVolume.DICOM.EchoTime", "%0.1f" % echoTime)
         seqNode.SetAttribute("MultiVolume.DICOM.FlipAngle", "%0.1f" % flipAngle)
-        seqNode.SetAttribute("MultiVolume.FrameLabels", frameLabels)
+        if seqNode.GetAttribute("MultiVolume.FrameLabels") is not None:
+            # Outdated now, regenerated on demand
+            seqNode.RemoveAttribute("MultiVolume.FrameLabels")
         seqNode.SetAttribute(
             "MultiVolume.FrameIdentifyingDICOMTagName", "AcquisitionTime"
         )
 
         errorCode, errorMsg = (0, "")
 
-        slicer.util.messageBox(
-            "Perfusion tags successfully applied to volume sequence!"
-        )
-
         # import time
         # startTime = time.time()
         # logging.info("Processing started")
@@ -670,6 +1521,196 @@ class PerfusionHelperLogic(ScriptedLoadableModuleLogic):
         # logging.info(f"Processing completed in {stopTime-startTime:.2f} seconds")
         return errorCode, errorMsg
 
+    def detectBaselineFrames(
+        self, meanSignalCurve, skipFirstFrames=1, minimumNumberOfBaselineFrames=2
+    ):
+        """Return the indexes of the pre-bolus baseline frames of a DSC signal curve (the mean signal
+        of each frame), i.e. the frames before the first significant signal drop. The first
+        skipFirstFrames frames are excluded, because they are often brighter due to T1 saturation
+        effects before the steady state is reached (unless the sequence is too short for that).
+        """
+        import numpy as np
+
+        curve = np.asarray(meanSignalCurve, dtype=float)
+        numberOfFrames = len(curve)
+        if numberOfFrames <= minimumNumberOfBaselineFrames:
+            return np.arange(numberOfFrames)
+        if numberOfFrames - skipFirstFrames < minimumNumberOfBaselineFrames + 1:
+            skipFirstFrames = 0
+        # Estimate the baseline level and its noise from the first frames with robust statistics
+        windowSize = max(minimumNumberOfBaselineFrames + 1, numberOfFrames // 10)
+        window = curve[skipFirstFrames : skipFirstFrames + windowSize]
+        baselineLevel = np.median(window)
+        noise = 1.4826 * np.median(np.abs(window - baselineLevel))
+        noise = max(noise, 0.01 * abs(baselineLevel))
+        # Bolus arrival is the first frame clearly below the baseline level
+        dropFrames = np.nonzero(curve[skipFirstFrames:] < baselineLevel - 3 * noise)[0]
+        if len(dropFrames):
+            bolusArrivalFrame = skipFirstFrames + dropFrames[0]
+        else:
+            bolusArrivalFrame = numberOfFrames
+        bolusArrivalFrame = max(
+            bolusArrivalFrame, skipFirstFrames + minimumNumberOfBaselineFrames
+        )
+        return np.arange(skipFirstFrames, bolusArrivalFrame)
+
+    def computeMeanSignalCurve(self, frameArrays):
+        """Return the mean signal of each frame, over the voxels whose time-averaged signal is above
+        the overall mean (so that air and background do not dilute the curve)."""
+        import numpy as np
+
+        meanImage = np.zeros(frameArrays[0].shape, dtype=np.float64)
+        for frameArray in frameArrays:
+            meanImage += frameArray
+        meanImage /= len(frameArrays)
+        tissue = meanImage >= meanImage.mean()
+        return np.array([frameArray[tissue].mean() for frameArray in frameArrays])
+
+    def selectReferenceFrame(self, inputSequence, downsamplingFactor=2):
+        """Return the index of the frame of inputSequence that is the best registration reference:
+        the pre-bolus baseline frame (see detectBaselineFrames) whose voxel intensities correlate
+        best, on average, with all frames of the sequence. This avoids the first frame, which is
+        often affected by T1 saturation, and frames during the bolus passage, which look very
+        different from the others. All frames are analyzed at once on a grid downsampled by
+        downsamplingFactor along each axis.
+        """
+        import numpy as np
+
+        numberOfFrames = inputSequence.GetNumberOfDataNodes()
+        if numberOfFrames < 3:
+            return 0
+        step = max(1, int(downsamplingFactor))
+        frameArrays = [
+            slicer.util.arrayFromVolume(inputSequence.GetNthDataNode(t))[
+                ::step, ::step, ::step
+            ]
+            for t in range(numberOfFrames)
+        ]
+        baselineFrames = self.detectBaselineFrames(
+            self.computeMeanSignalCurve(frameArrays)
+        )
+        # Correlation coefficients between all pairs of frames
+        frames = np.stack([frameArray.ravel() for frameArray in frameArrays]).astype(
+            np.float32
+        )
+        frames -= frames.mean(axis=1, keepdims=True)
+        norms = np.linalg.norm(frames, axis=1)
+        norms[norms == 0] = 1.0
+        frames /= norms[:, np.newaxis]
+        correlation = frames @ frames.T
+        similarity = correlation.mean(axis=1)
+        referenceFrame = int(baselineFrames[np.argmax(similarity[baselineFrames])])
+        self.addLog(
+            "Selected frame %i as reference (baseline frames %i-%i, mean correlation %.3f)"
+            % (
+                referenceFrame,
+                baselineFrames[0],
+                baselineFrames[-1],
+                similarity[referenceFrame],
+            )
+        )
+        return referenceFrame
+
+    def computeDeltaR2StarSequence(
+        self,
+        inputSequence,
+        outputSequence=None,
+        baselineFrames=None,
+        numberOfThreads=None,
+    ):
+        """Convert a tagged (see gatherTagsFromDICOMTag) and optionally registered DSC sequence to
+        a sequence of delta R2* maps (in 1/s): dR2*(t) = -ln(S(t)/S0) / TE
+        S0 is the mean of the baseline frames, which are detected from the mean signal curve (see
+        detectBaselineFrames) unless baselineFrames (frame indexes) is given. Voxels with S0 <= 0
+        are set to 0. The computation is vectorized over slabs of slices of all frames, which are
+        processed by numberOfThreads threads (default: core budget) and written directly into the
+        frames stored in the output sequence, so the output is held in memory only once. A new
+        output sequence is created if outputSequence is None. Returns the output sequence and the
+        baseline frame indexes.
+        """
+        import numpy as np
+        from concurrent.futures import ThreadPoolExecutor
+
+        echoTimeStr = inputSequence.GetAttribute("MultiVolume.DICOM.EchoTime")
+        if not echoTimeStr:
+            raise Exception(
+                "Sequence %s has no echo time, gather tags from DICOM first!"
+                % inputSequence.GetName()
+            )
+        echoTimeSec = float(echoTimeStr) / 1000.0  # EchoTime tag is in ms
+        numberOfFrames = inputSequence.GetNumberOfDataNodes()
+        frameNodes = [inputSequence.GetNthDataNode(t) for t in range(numberOfFrames)]
+        # Views of the frame voxels, no copy
+        frameArrays = [slicer.util.arrayFromVolume(node) for node in frameNodes]
+        if frameArrays[0].ndim != 3:
+            raise Exception("Only single-component volume sequences are supported")
+        if baselineFrames is None:
+            baselineFrames = self.detectBaselineFrames(
+                self.computeMeanSignalCurve(frameArrays)
+            )
+        baselineFrames = np.asarray(baselineFrames)
+        self.addLog("Baseline frames for S0: %s" % baselineFrames.tolist())
+
+        # Insert the output frames first and write the results directly into the voxel arrays of
+        # the frames stored in the sequence, which copies the inserted node, so that the output
+        # only exists once (plus one frame)
+        if outputSequence is None:
+            outputSequence = self.newNode(
+                "vtkMRMLSequenceNode", inputSequence.GetName() + "_DeltaR2Star"
+            )
+        self.initializeOutputSequences(inputSequence, [outputSequence])
+        frameTemplateNode = slicer.vtkMRMLScalarVolumeNode()
+        imageData = vtk.vtkImageData()
+        imageData.SetDimensions(frameNodes[0].GetImageData().GetDimensions())
+        imageData.AllocateScalars(vtk.VTK_FLOAT, 1)
+        frameTemplateNode.SetAndObserveImageData(imageData)
+        outputNodes = []
+        outputArrays = []
+        for t, frameNode in enumerate(frameNodes):
+            frameTemplateNode.CopyOrientation(frameNode)
+            outputNode = outputSequence.SetDataNodeAtValue(
+                frameTemplateNode, inputSequence.GetNthIndexValue(t)
+            )
+            outputNodes.append(outputNode)
+            outputArrays.append(slicer.util.arrayFromVolume(outputNode))
+        frameTemplateNode = None
+        imageData = None
+
+        if numberOfThreads is None:
+            numberOfThreads = self.createJobScheduler().coreBudget
+        numberOfSlices, rows, columns = frameArrays[0].shape
+        # Slabs of about 64MB keep the working set of each thread small, and there should be at
+        # least one slab per thread
+        sliceBytes = numberOfFrames * rows * columns * 4
+        slabSlices = max(1, (64 * 1024 * 1024) // sliceBytes)
+        slabSlices = min(slabSlices, -(-numberOfSlices // numberOfThreads))
+
+        def computeSlab(firstSlice):
+            lastSlice = min(firstSlice + slabSlices, numberOfSlices)
+            signal = np.stack(
+                [frameArray[firstSlice:lastSlice] for frameArray in frameArrays]
+            ).astype(np.float32)
+            s0 = signal[baselineFrames].mean(axis=0)
+            valid = s0 > 0
+            s0[~valid] = 1.0
+            # In-place operations, so that only one slab-sized array is allocated
+            np.maximum(signal, np.finfo(np.float32).tiny, out=signal)
+            np.divide(signal, s0, out=signal)
+            np.log(signal, out=signal)
+            signal *= -1.0 / echoTimeSec
+            signal[:, ~valid] = 0.0
+            for t in range(numberOfFrames):
+                outputArrays[t][firstSlice:lastSlice] = signal[t]
+
+        with ThreadPoolExecutor(max_workers=numberOfThreads) as executor:
+            # list() to raise any exception from the threads
+            list(executor.map(computeSlab, range(0, numberOfSlices, slabSlices)))
+
+        for outputNode in outputNodes:
+            slicer.util.arrayFromVolumeModified(outputNode)
+        self.transferTags(inputSequence, outputSequence)
+        return outputSequence, baselineFrames
+
     def newNode(self, nodeClass, baseNodeName):
         # Convenience function for repeated code used for generating unique names
         # AddNewNodeByClass is supposed to do this according to the docs, but it doesn't
@@ -677,13 +1718,12 @@ class PerfusionHelperLogic(ScriptedLoadableModuleLogic):
         node = slicer.mrmlScene.AddNewNodeByClass(nodeClass, nodeName)
         return node
 
-    def runBrainsRegistration(self, fixed, moving, outputTransform=None):
-        """Run registration without any fancy stuff, assuming a fairly close match between volumes."""
-        if outputTransform is None:
-            outputTransform = slicer.mrmlScene.AddNewNodeByClass(
-                "vtkMRMLLinearTransformNode",
-                "_".join([fixed.GetName(), "to", moving.GetName(), "Transform"]),
-            )
+    def brainsRegistrationParameters(
+        self, fixed, moving, outputTransform, outputVolume=None, fixedMask=None
+    ):
+        """Build the BRAINSFit CLI parameter dictionary for a rigid registration of moving to fixed,
+        assuming a fairly close match between volumes. If fixedMask is given, the metric is only
+        sampled inside it."""
         parameters = {
             "fixedVolume": fixed,
             "movingVolume": moving,
@@ -692,9 +1732,201 @@ class PerfusionHelperLogic(ScriptedLoadableModuleLogic):
             "initializeTransformMode": "Off",  # assumes already close in physical space
             "useRigid": True,
         }
-        slicer.cli.runSync(slicer.modules.brainsfit, None, parameters=parameters)
+        if outputVolume is not None:
+            parameters["outputVolume"] = outputVolume
+        if fixedMask is not None:
+            parameters["maskProcessingMode"] = "ROI"
+            parameters["fixedBinaryVolume"] = fixedMask
+        return parameters
+
+    def createJobScheduler(self, maxConcurrentJobs=None):
+        """Create a RegistrationJobScheduler using the core budget settings of this logic."""
+        return RegistrationJobScheduler(
+            coreBudget=self.coreBudget,
+            maxConcurrentJobs=maxConcurrentJobs or self.maxConcurrentJobs,
+            pinToCores=self.pinJobsToCores,
+        )
+
+    def runBrainsRegistration(self, fixed, moving, outputTransform=None):
+        """Run registration without any fancy stuff, assuming a fairly close match between volumes."""
+        if outputTransform is None:
+            outputTransform = slicer.mrmlScene.AddNewNodeByClass(
+                "vtkMRMLLinearTransformNode",
+                "_".join([fixed.GetName(), "to", moving.GetName(), "Transform"]),
+            )
+        parameters = self.brainsRegistrationParameters(fixed, moving, outputTransform)
+        scheduler = self.createJobScheduler(maxConcurrentJobs=1)
+        scheduler.submit(BrainsRegistrationJob(parameters))
+        scheduler.runUntilDone()
         return outputTransform
 
+    def runBrainsRegistrationBatch(
+        self,
+        fixed,
+        movingNodes,
+        outputTransforms=None,
+        outputVolumes=None,
+        maxConcurrentJobs=None,
+        onJobFinished=None,
+        fixedMask=None,
+    ):
+        """Register each of movingNodes to fixed with BRAINSFit, running several CLI jobs at once.
+        All nodes must be in the scene. Jobs are run by a RegistrationJobScheduler, so the jobs
+        together fill the core budget without oversubscribing it and excess jobs are queued.
+        Missing output transforms are created. If outputVolumes is given, each entry (or None)
+        receives the resampled moving volume. If fixedMask is given, each registration only samples
+        the fixed volume inside it. onJobFinished(jobIndex, outputTransform) is called as
+        soon as each job completes, so results can be collected (and temporary nodes released)
+        before the whole batch is done. Returns the list of output transform nodes.
+        """
+        numberOfJobs = len(movingNodes)
+        if outputTransforms is None:
+            outputTransforms = [None] * numberOfJobs
+        outputTransforms = list(outputTransforms)
+        if outputVolumes is None:
+            outputVolumes = [None] * numberOfJobs
+        scheduler = self.createJobScheduler(maxConcurrentJobs)
+        for jobIdx, moving in enumerate(movingNodes):
+            if outputTransforms[jobIdx] is None:
+                outputTransforms[jobIdx] = self.newNode(
+                    "vtkMRMLLinearTransformNode",
+                    "_".join([fixed.GetName(), "to", moving.GetName(), "Transform"]),
+                )
+            parameters = self.brainsRegistrationParameters(
+                fixed,
+                moving,
+                outputTransforms[jobIdx],
+                outputVolumes[jobIdx],
+                fixedMask,
+            )
+            job = BrainsRegistrationJob(parameters)
+            if onJobFinished:
+                job.onFinished = lambda job, jobIdx=jobIdx: onJobFinished(
+                    jobIdx, outputTransforms[jobIdx]
+                )
+            scheduler.submit(job)
+        self.addLog(
+            "Running %i BRAINSFit jobs within a budget of %i cores"
+            % (numberOfJobs, scheduler.coreBudget)
+        )
+        scheduler.runUntilDone()
+        return outputTransforms
+
+    def runBrainsSequenceRegistration(
+        self,
+        inputSequence,
+        outputSequence,
+        outputTransformSequence=None,
+        fixedVolumeItemNumber=0,
+        maxConcurrentJobs=None,
+        chunkSize=None,
+        fixedVolumeMaskNode=None,
+    ):
+        """Register every frame of inputSequence to frame fixedVolumeItemNumber with concurrent
+        BRAINSFit jobs (see runBrainsRegistrationBatch). Resampled frames are written to
+        outputSequence and, if given, moving-to-fixed transforms to outputTransformSequence. Frames
+        are copied into the scene chunkSize frames at a time (default: all), and only while their job
+        is queued or running. If fixedVolumeMaskNode is given, only voxels inside it are sampled.
+        """
+        numberOfFrames = inputSequence.GetNumberOfDataNodes()
+        self.initializeOutputSequences(
+            inputSequence, [outputSequence, outputTransformSequence]
+        )
+        fixed = self.addSequenceFrameToScene(
+            inputSequence, fixedVolumeItemNumber, "PerfusionHelperFixedFrame"
+        )
+        # The fixed frame is already registered to itself
+        outputSequence.SetDataNodeAtValue(
+            fixed, inputSequence.GetNthIndexValue(fixedVolumeItemNumber)
+        )
+        if outputTransformSequence is not None:
+            identityTransform = slicer.vtkMRMLLinearTransformNode()
+            outputTransformSequence.SetDataNodeAtValue(
+                identityTransform,
+                inputSequence.GetNthIndexValue(fixedVolumeItemNumber),
+            )
+        allItemNumbers = [
+            itemNumber
+            for itemNumber in range(numberOfFrames)
+            if itemNumber != fixedVolumeItemNumber
+        ]
+        chunkSize = max(1, chunkSize or len(allItemNumbers))
+        try:
+            for chunkStart in range(0, len(allItemNumbers), chunkSize):
+                self.runBrainsSequenceRegistrationChunk(
+                    inputSequence,
+                    outputSequence,
+                    outputTransformSequence,
+                    fixed,
+                    allItemNumbers[chunkStart : chunkStart + chunkSize],
+                    maxConcurrentJobs,
+                    fixedVolumeMaskNode,
+                )
+        finally:
+            slicer.mrmlScene.RemoveNode(fixed)
+
+    def runBrainsSequenceRegistrationChunk(
+        self,
+        inputSequence,
+        outputSequence,
+        outputTransformSequence,
+        fixed,
+        itemNumbers,
+        maxConcurrentJobs,
+        fixedVolumeMaskNode=None,
+    ):
+        movingNodes = []
+        outputVolumes = []
+        for itemNumber in itemNumbers:
+            movingNodes.append(
+                self.addSequenceFrameToScene(
+                    inputSequence, itemNumber, "PerfusionHelperMovingFrame"
+                )
+            )
+            outputVolumes.append(
+                self.newNode(
+                    "vtkMRMLScalarVolumeNode", "PerfusionHelperRegisteredFrame"
+                )
+            )
+        outputTransforms = [
+            self.newNode("vtkMRMLLinearTransformNode", "PerfusionHelperFrameTransform")
+            for itemNumber in itemNumbers
+        ]
+
+        def collectFrame(jobIdx, outputTransform):
+            indexValue = inputSequence.GetNthIndexValue(itemNumbers[jobIdx])
+            outputSequence.SetDataNodeAtValue(outputVolumes[jobIdx], indexValue)
+            if outputTransformSequence is not None:
+                outputTransformSequence.SetDataNodeAtValue(outputTransform, indexValue)
+            # Release the scene copies of this frame right away
+            for node in [movingNodes[jobIdx], outputVolumes[jobIdx], outputTransform]:
+                slicer.mrmlScene.RemoveNode(node)
+
+        try:
+            self.runBrainsRegistrationBatch(
+                fixed,
+                movingNodes,
+                outputTransforms,
+                outputVolumes,
+                maxConcurrentJobs=maxConcurrentJobs,
+                onJobFinished=collectFrame,
+                fixedMask=fixedVolumeMaskNode,
+            )
+        finally:
+            # Remove whatever is left in the scene (everything, if a job failed)
+            for node in movingNodes + outputVolumes + outputTransforms:
+                if node.GetScene():
+                    slicer.mrmlScene.RemoveNode(node)
+
+    def addSequenceFrameToScene(self, seqNode, itemNumber, baseNodeName):
+        """Add a copy of the itemNumber-th data node of seqNode to the scene (CLI modules can only
+        work on nodes in the scene) and return it.
+        """
+        dataNode = seqNode.GetNthDataNode(itemNumber)
+        frameNode = self.newNode(dataNode.GetClassName(), baseNodeName)
+        frameNode.CopyContent(dataNode)
+        return frameNode
+
     def runElastixRegistration(
         self,
         fixedVolumeNode,
@@ -730,16 +1962,66 @@ class PerfusionHelperLogic(ScriptedLoadableModuleLogic):
             elastixOutputTransform = self.newNode(
                 "vtkMRMLLinearTransformNode", "ElastixOutputTranform"
             )
-        import Elastix, qt
-
-        elastixLogic = Elastix.ElastixLogic()
         # Create temporary directory to hold volumes used for Elastix registration and registration results
-        tempDir = elastixLogic.createTempDirectory()
-        # Create inputs subdirectory
-        inputDir = os.path.join(tempDir, "input")
-        qt.QDir().mkpath(inputDir)
-        # Create desired parameter file in this temp directory
-        parameterFilePath = self.createElastixParameterFile(
+        tempDir = self.getElastixLogic().createTempDirectory()
+        self.addLog("Volume registration is started in working directory: " + tempDir)
+        inputParamsElastix = self.writeElastixRegistrationInputs(
+            tempDir,
+            fixedVolumeNode,
+            movingVolumeNode,
+            fixedVolumeMaskNode,
+            movingVolumeMaskNode,
+            prealigned=prealigned,
+            maskHasFalseHardEdge=maskHasFalseHardEdge,
+            Scales=Scales,
+        )
+        resultTransformDir = os.path.join(tempDir, "result-transform")
+        # Run the registration! The scheduler passes an explicit "-threads" within the core budget,
+        # and process output goes to a log file so the pipe can never fill up and stall elastix
+        elastixExecutablePath, elastixEnv = self.getElastixExecutable()
+        scheduler = self.createJobScheduler(maxConcurrentJobs=1)
+        scheduler.submit(
+            ElastixRegistrationJob(
+                elastixExecutablePath,
+                inputParamsElastix,
+                env=elastixEnv,
+                logFilePath=os.path.join(tempDir, "elastix_output.txt"),
+                workingDirectory=tempDir,
+            )
+        )
+        scheduler.runUntilDone()
+        self.addLog(
+            "\nRegistration complete, transform in:\n   %s" % resultTransformDir
+        )
+        # Import the resulting transform
+        self.importElastixTransform(resultTransformDir, elastixOutputTransform)
+        # Clean up temporary nodes/files
+        if self.deleteTempElastixFiles:
+            import shutil
+
+            shutil.rmtree(tempDir)
+        return elastixOutputTransform
+
+    def writeElastixRegistrationInputs(
+        self,
+        workingDir,
+        fixedVolumeNode,
+        movingVolumeNode,
+        fixedVolumeMaskNode=None,
+        movingVolumeMaskNode=None,
+        prealigned=False,
+        maskHasFalseHardEdge=False,
+        Scales=None,
+    ):
+        """Write the input volumes and the parameter file of an elastix registration to
+        workingDir/input and create the workingDir/result-transform output directory (see
+        runElastixRegistration for the options). Returns the elastix command line arguments, with
+        paths relative to workingDir, so the directory is self-contained and can be run anywhere.
+        """
+        inputDir = os.path.join(workingDir, "input")
+        os.makedirs(inputDir, exist_ok=True)
+        # Create desired parameter file in the input directory
+        self.createElastixParameterFile(
             inputDir,
             prealigned=prealigned,
             maskHasFalseHardEdge=maskHasFalseHardEdge,
@@ -747,75 +2029,312 @@ class PerfusionHelperLogic(ScriptedLoadableModuleLogic):
         )
         # Assemble command line parameters and save copies of inputs to input directory
         inputParamsElastix = []  # list to hold command line arguments
-        self.addLog("Volume registration is started in working directory: " + tempDir)
-        # Add input volumes
         inputVolumes = []
-        inputVolumes.append([fixedVolumeNode, "fixed.mha", "-f"])
-        inputVolumes.append([movingVolumeNode, "moving.mha", "-m"])
-        inputVolumes.append([fixedVolumeMaskNode, "fixedMask.mha", "-fMask"])
-        inputVolumes.append([movingVolumeMaskNode, "movingMask.mha", "-mMask"])
+        inputVolumes.append([fixedVolumeNode, "fixed.mhd", "-f"])
+        inputVolumes.append([movingVolumeNode, "moving.mhd", "-m"])
+        inputVolumes.append([fixedVolumeMaskNode, "fixedMask.mhd", "-fMask"])
+        inputVolumes.append([movingVolumeMaskNode, "movingMask.mhd", "-mMask"])
         for [volumeNode, filename, paramName] in inputVolumes:
             if not volumeNode:
                 continue
-            # Save original file paths
-            originalFilePath = ""
-            originalFilePaths = []
-            volumeStorageNode = volumeNode.GetStorageNode()
-            if volumeStorageNode:
-                originalFilePath = volumeStorageNode.GetFileName()
-                for fileIndex in range(volumeStorageNode.GetNumberOfFileNames()):
-                    originalFilePaths.append(
-                        volumeStorageNode.GetNthFileName(fileIndex)
-                    )
-            # Save to new location
-            filePath = os.path.join(inputDir, filename)
-            slicer.util.saveNode(volumeNode, filePath, {"useCompression": False})
+            self.exportVolumeForElastix(volumeNode, os.path.join(inputDir, filename))
             inputParamsElastix.append(paramName)
-            inputParamsElastix.append(filePath)
-            # Restore original file paths
-            if volumeStorageNode:
-                volumeStorageNode.ResetFileNameList()
-                volumeStorageNode.SetFileName(originalFilePath)
-                for fileIndex in range(volumeStorageNode.GetNumberOfFileNames()):
-                    volumeStorageNode.AddFileName(originalFilePaths[fileIndex])
-            else:
-                # temporary storage node was created, remove it to restore original state
-                volumeStorageNode = volumeNode.GetStorageNode()
-                slicer.mrmlScene.RemoveNode(volumeStorageNode)
+            inputParamsElastix.append(os.path.join("input", filename))
         # Specify output location
-        resultTransformDir = os.path.join(tempDir, "result-transform")
-        qt.QDir().mkpath(resultTransformDir)
-        inputParamsElastix += ["-out", resultTransformDir]
+        os.makedirs(os.path.join(workingDir, "result-transform"), exist_ok=True)
+        inputParamsElastix += ["-out", "result-transform"]
         # Specify parameter file
         inputParamsElastix.append("-p")
-        inputParamsElastix.append(parameterFilePath)
-        # Run the registration!
-        ep = elastixLogic.startElastix(inputParamsElastix)
-        # ep.stdout.close()  # Needed or ep.wait() hangs forever
-        # return_code = ep.wait() # returns when the process ends?
-        elastixLogic.logProcessOutput(
-            ep
-        )  # if I don't do this line, the registration stalls at the start of resolution 0 unless I uncomment and run the previous two lines
-        self.addLog(
-            "\nRegistration complete, transform in:\n   %s" % resultTransformDir
+        inputParamsElastix.append(os.path.join("input", "ElastixParameters.txt"))
+        return inputParamsElastix
+
+    # Registration preset of the Elastix module used for sequence registration ("generic rigid (all)")
+    SEQUENCE_REGISTRATION_PRESET_INDEX = 1
+
+    def writeSequenceRegistrationParameterFiles(self, destDir, numberOfSpatialSamples=None):
+        """Copy the parameter files of the Elastix module preset that SequenceRegistration uses
+        (SEQUENCE_REGISTRATION_PRESET_INDEX) to destDir, optionally with a different number of
+        spatial samples, and return their paths in registration order. Result images are not
+        written, because frames are resampled after importing the transforms."""
+        import re
+
+        import Elastix
+
+        overrides = {"WriteResultImage": '"false"'}
+        if numberOfSpatialSamples is not None:
+            overrides["NumberOfSpatialSamples"] = str(int(numberOfSpatialSamples))
+        elastixLogic = self.getElastixLogic()
+        preset = elastixLogic.getRegistrationPresets()[
+            self.SEQUENCE_REGISTRATION_PRESET_INDEX
+        ]
+        parameterFilePaths = []
+        for fileName in preset[Elastix.RegistrationPresets_ParameterFilenames]:
+            with open(
+                os.path.join(elastixLogic.registrationParameterFilesDir, fileName)
+            ) as f:
+                parameters = f.read()
+            for name, value in overrides.items():
+                parameter = "(%s %s)" % (name, value)
+                parameters, numberOfReplacements = re.subn(
+                    r"^\s*\(%s\s[^)]*\)" % name,
+                    parameter,
+                    parameters,
+                    flags=re.MULTILINE,
+                )
+                if not numberOfReplacements:
+                    parameters += "\n" + parameter + "\n"
+            parameterFilePath = os.path.join(destDir, os.path.basename(fileName))
+            with open(parameterFilePath, "w") as f:
+                f.write(parameters)
+            parameterFilePaths.append(parameterFilePath)
+        return parameterFilePaths
+
+    def exportVolumeForElastix(self, volumeNode, filePath):
+        """Write volumeNode uncompressed to filePath for elastix (see writeMetaImage). The volume
+        node does not have to be in the scene and the scene is not modified."""
+        self.writeMetaImage(volumeNode, filePath)
+
+    # MetaImage element types of numpy scalar types
+    META_IMAGE_ELEMENT_TYPES = {
+        "int8": "MET_CHAR",
+        "uint8": "MET_UCHAR",
+        "int16": "MET_SHORT",
+        "uint16": "MET_USHORT",
+        "int32": "MET_INT",
+        "uint32": "MET_UINT",
+        "int64": "MET_LONG_LONG",
+        "uint64": "MET_ULONG_LONG",
+        "float32": "MET_FLOAT",
+        "float64": "MET_DOUBLE",
+    }
+
+    def writeMetaImage(self, volumeNode, filePath):
+        """Write the voxels of volumeNode to an uncompressed MetaImage: a detached header at filePath
+        (by convention with .mhd extension, .mha is for inline data) and the raw voxel data next to
+        it (same name with .raw extension). The voxel buffer is written
+        directly from a numpy view of the image data, without copying it or going through a
+        storage node. The IJK to RAS geometry is converted to the LPS origin, spacing and direction
+        of the header, as the MRML volume writer does. Returns the path of the raw data file.
+        """
+        import sys
+
+        import numpy as np
+
+        imageData = volumeNode.GetImageData()
+        voxels = slicer.util.arrayFromVolume(volumeNode)  # view, shares memory with imageData
+        numberOfComponents = imageData.GetNumberOfScalarComponents()
+        elementType = self.META_IMAGE_ELEMENT_TYPES.get(voxels.dtype.name)
+        if elementType is None:
+            raise Exception(
+                "Cannot write %s voxels of %s to MetaImage"
+                % (voxels.dtype.name, volumeNode.GetName())
+            )
+        # Voxel geometry in LPS, starting at the first voxel of the extent
+        ijkToRAS = vtk.vtkMatrix4x4()
+        volumeNode.GetIJKToRASMatrix(ijkToRAS)
+        ijkToLPS = np.diag([-1, -1, 1, 1]) @ slicer.util.arrayFromVTKMatrix(ijkToRAS)
+        extent = imageData.GetExtent()
+        origin = ijkToLPS @ [extent[0], extent[2], extent[4], 1]
+        spacing = np.linalg.norm(ijkToLPS[:3, :3], axis=0)
+        directions = ijkToLPS[:3, :3] / spacing
+        rawFilePath = os.path.splitext(filePath)[0] + ".raw"
+        header = [
+            "ObjectType = Image",
+            "NDims = 3",
+            "BinaryData = True",
+            "BinaryDataByteOrderMSB = %s"
+            % ("True" if sys.byteorder == "big" else "False"),
+            "CompressedData = False",
+            # One direction (column of the direction matrix) after the other
+            "TransformMatrix = " + " ".join(["%.17g" % v for v in directions.T.flat]),
+            "Offset = " + " ".join(["%.17g" % v for v in origin[:3]]),
+            "CenterOfRotation = 0 0 0",
+            "ElementSpacing = " + " ".join(["%.17g" % v for v in spacing]),
+            "DimSize = " + " ".join([str(d) for d in imageData.GetDimensions()]),
+        ]
+        if numberOfComponents > 1:
+            header.append("ElementNumberOfChannels = %i" % numberOfComponents)
+        header += [
+            "ElementType = " + elementType,
+            # Must be the last field
+            "ElementDataFile = " + os.path.basename(rawFilePath),
+        ]
+        with open(filePath, "w") as headerFile:
+            headerFile.write("\n".join(header) + "\n")
+        with open(rawFilePath, "wb") as rawFile:
+            # VTK scalars are contiguous with x varying fastest, as MetaImage expects
+            rawFile.write(memoryview(voxels.reshape(-1)).cast("B"))
+        return rawFilePath
+
+    def submitElastixRegistrationJobToSharedDirectory(
+        self,
+        sharedDir,
+        fixedVolumeNode,
+        movingVolumeNode,
+        fixedVolumeMaskNode=None,
+        movingVolumeMaskNode=None,
+        jobName=None,
+        prealigned=False,
+        maskHasFalseHardEdge=False,
+        Scales=None,
+    ):
+        """Write a self-contained elastix registration job to sharedDir for
+        PerfusionHelperLib/RegistrationWorker.py processes, which may run on other machines that
+        see the same directory. The job is a sharedDir/<jobId> directory holding the inputs, the
+        parameter file and a job.json manifest with the elastix arguments. Returns the job ID, to be
+        passed to collectSharedDirectoryRegistrationResults.
+        """
+        import json
+        import uuid
+
+        os.makedirs(sharedDir, exist_ok=True)
+        jobId = "%s_%s" % (jobName or "registration", uuid.uuid4().hex[:12])
+        jobDir = os.path.join(sharedDir, jobId)
+        os.makedirs(jobDir)
+        arguments = self.writeElastixRegistrationInputs(
+            jobDir,
+            fixedVolumeNode,
+            movingVolumeNode,
+            fixedVolumeMaskNode,
+            movingVolumeMaskNode,
+            prealigned=prealigned,
+            maskHasFalseHardEdge=maskHasFalseHardEdge,
+            Scales=Scales,
         )
-        # Import the resulting transform
-        self.importElastixTransform(resultTransformDir, elastixOutputTransform)
-        # Clean up temporary nodes/files
-        if self.deleteTempElastixFiles:
-            import shutil
+        manifest = {
+            "jobId": jobId,
+            "movingVolume": movingVolumeNode.GetName(),
+            "fixedVolume": fixedVolumeNode.GetName(),
+            # Workers may run on another OS, elastix accepts "/" separators on all of them
+            "arguments": [argument.replace(os.sep, "/") for argument in arguments],
+        }
+        # Write the manifest last and atomically, so workers never pick up a partially written job
+        manifestPath = os.path.join(jobDir, "job.json")
+        with open(manifestPath + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(manifestPath + ".tmp", manifestPath)
+        return jobId
+
+    def collectSharedDirectoryRegistrationResults(
+        self,
+        sharedDir,
+        jobTransformNodes,
+        onJobImported=None,
+        timeout=1800,
+        pollInterval=0.5,
+        staleLockTimeout=60,
+        heartbeatInterval=None,
+    ):
+        """Wait for the jobs submitted by submitElastixRegistrationJobToSharedDirectory and import
+        each resulting transform as soon as a worker has finished the job. jobTransformNodes maps job
+        IDs to the transform nodes to set. onJobImported(jobId, transformNode) is called after each
+        import. Workers touch the job.lock file of a running job every heartbeatInterval seconds
+        (their --heartbeat-interval, None: the worker default); if a lock has not changed for
+        staleLockTimeout seconds, its worker is considered dead and the lock is deleted, so that
+        another worker runs the job. Raises an exception if a job failed or if no job finished for
+        timeout seconds (None: wait indefinitely).
+        """
+        import time
 
-            shutil.rmtree(tempDir)
-        return elastixOutputTransform
+        if heartbeatInterval is None:
+            from PerfusionHelperLib import RegistrationWorker
+
+            heartbeatInterval = RegistrationWorker.HEARTBEAT_INTERVAL
+        if staleLockTimeout <= heartbeatInterval:
+            raise Exception(
+                "The stale lock timeout (%g s) must be longer than the worker heartbeat interval"
+                " (%g s), otherwise locks of running jobs are deleted"
+                % (staleLockTimeout, heartbeatInterval)
+            )
+
+        lastProgressTime = time.time()
+        # job ID -> (lock file modification time, local time when it was first seen)
+        lockStates = {}
+        pendingJobIds = set(jobTransformNodes.keys())
+        while pendingJobIds:
+            for jobId in sorted(pendingJobIds):
+                jobDir = os.path.join(sharedDir, jobId)
+                if os.path.exists(os.path.join(jobDir, "job.failed")):
+                    with open(os.path.join(jobDir, "job.failed")) as f:
+                        raise Exception(
+                            "Registration job %s failed: %s" % (jobId, f.read())
+                        )
+                if not os.path.exists(os.path.join(jobDir, "job.done")):
+                    self.requeueStaleSharedDirectoryJob(
+                        jobDir, lockStates, staleLockTimeout
+                    )
+                    continue
+                self.importElastixTransform(
+                    os.path.join(jobDir, "result-transform"), jobTransformNodes[jobId]
+                )
+                pendingJobIds.remove(jobId)
+                lastProgressTime = time.time()
+                if onJobImported:
+                    onJobImported(jobId, jobTransformNodes[jobId])
+            if not pendingJobIds:
+                break
+            if timeout is not None and time.time() - lastProgressTime > timeout:
+                raise Exception(
+                    "Timed out waiting for registration jobs: " + ", ".join(pendingJobIds)
+                )
+            slicer.app.processEvents()
+            time.sleep(pollInterval)
+
+    def requeueStaleSharedDirectoryJob(self, jobDir, lockStates, staleLockTimeout):
+        """Delete the job.lock file of an unfinished shared directory job if its modification time
+        has not changed for staleLockTimeout seconds. Only the local clock is used, so clock
+        differences between machines do not matter. lockStates keeps the lock times seen so far."""
+        import time
+
+        lockPath = os.path.join(jobDir, "job.lock")
+        try:
+            lockTime = os.path.getmtime(lockPath)
+        except OSError:
+            # Not claimed yet
+            lockStates.pop(jobDir, None)
+            return
+        now = time.time()
+        if jobDir not in lockStates or lockStates[jobDir][0] != lockTime:
+            lockStates[jobDir] = (lockTime, now)
+            return
+        if now - lockStates[jobDir][1] < staleLockTimeout:
+            return
+        logging.warning(
+            "Worker of registration job %s stopped responding, queuing the job again" % jobDir
+        )
+        try:
+            os.remove(lockPath)
+        except OSError:
+            pass
+        lockStates.pop(jobDir, None)
 
     def importElastixTransform(self, resultTransformDir, outputTransformNode):
-        import Elastix
+        """Set outputTransformNode from the elastix result in resultTransformDir. The last
+        TransformParameters.<n>.txt file is read and its chain of initial transforms is composed
+        into a single matrix (see elastixTransformFileToMatrix), so multi-stage results are handled
+        without the Elastix module. Transform types that the built-in parser does not support are
+        read with the Elastix module instead.
+        """
+        transformFileName = self.findLastElastixTransformFile(resultTransformDir)
+        try:
+            transformMatrix = self.elastixTransformFileToMatrix(transformFileName)
+        except NotImplementedError as e:
+            logging.info(
+                "%s, falling back to the Elastix module transform reader" % str(e)
+            )
+            self.importElastixTransformWithElastixModule(
+                transformFileName, outputTransformNode
+            )
+            return
+        outputTransformNode.SetMatrixTransformFromParent(
+            slicer.util.vtkMatrixFromArray(transformMatrix)
+        )
 
-        elastixLogic = Elastix.ElastixLogic()
+    def importElastixTransformWithElastixModule(
+        self, transformFileName, outputTransformNode
+    ):
+        elastixLogic = self.getElastixLogic()
         generalTransformFromParent = vtk.vtkGeneralTransform()
-        transformFileName = (
-            resultTransformDir + "/TransformParameters.0.txt"
-        )  # would need to be adjusted if there were multiple parameters run!!!
         elastixLogic.readElastixLinearTransformToVTK(
             transformFileName, generalTransformFromParent
         )
@@ -833,10 +2352,146 @@ class PerfusionHelperLogic(ScriptedLoadableModuleLogic):
             slicer.util.errorDisplay(
                 "Imported Elastix transform was not linear!  Errors may ensue, because this is not the expected case"
             )
-        elastixTransformFileImported = True
+
+    def findLastElastixTransformFile(self, resultTransformDir):
+        """Return the path of the TransformParameters.<n>.txt file with the highest n, which is the
+        result of the last registration stage (it refers to the earlier stages as initial transforms).
+        """
+        import re
+
+        stageFiles = {}
+        for fileName in os.listdir(resultTransformDir):
+            match = re.match(r"^TransformParameters\.(\d+)\.txt$", fileName)
+            if match:
+                stageFiles[int(match.group(1))] = fileName
+        if not stageFiles:
+            raise Exception(
+                "No elastix transform parameter file found in %s" % resultTransformDir
+            )
+        return os.path.join(resultTransformDir, stageFiles[max(stageFiles)])
+
+    def readElastixTransformParameterFile(self, filePath):
+        """Read an elastix parameter file into a dictionary which maps each parameter name to the
+        list of its values. Quoted values are returned as strings without quotes, others as floats.
+        """
+        import re
+
+        parameters = {}
+        tokenPattern = re.compile(r'"[^"]*"|[^\s"]+')
+        with open(filePath) as f:
+            for line in f:
+                line = line.strip()
+                if not line.startswith("("):
+                    # empty or comment line
+                    continue
+                tokens = tokenPattern.findall(line[1 : line.rindex(")")])
+                if not tokens:
+                    continue
+                values = []
+                for token in tokens[1:]:
+                    if token.startswith('"'):
+                        values.append(token[1:-1])
+                    else:
+                        try:
+                            values.append(float(token))
+                        except ValueError:
+                            values.append(token)
+                parameters[tokens[0]] = values
+        return parameters
+
+    def elastixTransformFileToMatrix(self, filePath):
+        """Compute the 4x4 homogeneous matrix (as a numpy array) of the transform described by an
+        elastix transform parameter file, including its chain of InitialTransformParametersFileName
+        files. Like the elastix transform, the matrix maps points from the fixed image space to the
+        moving image space, but in RAS instead of LPS coordinates, so it can be used directly as the
+        "transform from parent" of the moving image.
+        Euler, affine and translation transforms are supported, NotImplementedError is raised for
+        other transform types.
+        """
+        import numpy as np
+
+        lpsToRas = np.diag([-1.0, -1.0, 1.0, 1.0])
+        transformMatrix = self.elastixTransformFileToLPSMatrix(filePath)
+        return lpsToRas @ transformMatrix @ lpsToRas
+
+    def elastixTransformFileToLPSMatrix(self, filePath, visitedFilePaths=None):
+        import numpy as np
+
+        # Guard against circular references between initial transform files
+        visitedFilePaths = set(visitedFilePaths or [])
+        if os.path.abspath(filePath) in visitedFilePaths:
+            raise Exception("Circular elastix initial transform reference: " + filePath)
+        visitedFilePaths.add(os.path.abspath(filePath))
+
+        p = self.readElastixTransformParameterFile(filePath)
+        transformType = p["Transform"][0]
+        dimension = int(p.get("FixedImageDimension", [3])[0])
+        if dimension != 3:
+            raise NotImplementedError(
+                "%iD elastix transforms are not supported" % dimension
+            )
+        params = np.array(p["TransformParameters"], dtype=float)
+        center = np.array(p.get("CenterOfRotationPoint", [0.0, 0.0, 0.0]), dtype=float)
+        if transformType == "EulerTransform":
+            angleX, angleY, angleZ = params[0:3]
+            translation = params[3:6]
+            cx, sx = np.cos(angleX), np.sin(angleX)
+            cy, sy = np.cos(angleY), np.sin(angleY)
+            cz, sz = np.cos(angleZ), np.sin(angleZ)
+            rotationX = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+            rotationY = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+            rotationZ = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+            # Same rotation order as itk::Euler3DTransform
+            if p.get("ComputeZYX", ["false"])[0] == "true":
+                linear = rotationZ @ rotationY @ rotationX
+            else:
+                linear = rotationZ @ rotationX @ rotationY
+        elif transformType == "AffineTransform":
+            linear = params[0:9].reshape(3, 3)
+            translation = params[9:12]
+        elif transformType == "TranslationTransform":
+            linear = np.eye(3)
+            translation = params[0:3]
+        else:
+            raise NotImplementedError(
+                "Elastix transform type %s is not supported" % transformType
+            )
+        # y = A (x - c) + c + t
+        transformMatrix = np.eye(4)
+        transformMatrix[0:3, 0:3] = linear
+        transformMatrix[0:3, 3] = translation + center - linear @ center
+
+        initialFilePath = p.get("InitialTransformParametersFileName", [""])[0]
+        if initialFilePath and initialFilePath != "NoInitialTransform":
+            if not os.path.exists(initialFilePath):
+                # The result directory may have been moved since elastix wrote it (elastix writes
+                # absolute paths), look for the file next to this one
+                initialFilePath = os.path.join(
+                    os.path.dirname(filePath), os.path.basename(initialFilePath)
+                )
+            initialMatrix = self.elastixTransformFileToLPSMatrix(
+                initialFilePath, visitedFilePaths
+            )
+            howToCombine = p.get("HowToCombineTransforms", ["Compose"])[0]
+            if howToCombine == "Compose":
+                # T(x) = T_current(T_initial(x))
+                transformMatrix = transformMatrix @ initialMatrix
+            elif howToCombine == "Add":
+                # T(x) = T_current(x) + T_initial(x) - x
+                transformMatrix = transformMatrix + initialMatrix - np.eye(4)
+            else:
+                raise NotImplementedError(
+                    "HowToCombineTransforms %s is not supported" % howToCombine
+                )
+        return transformMatrix
 
     def createElastixParameterFile(
-        self, destDir, prealigned=False, maskHasFalseHardEdge=False, Scales=None
+        self,
+        destDir,
+        prealigned=False,
+        maskHasFalseHardEdge=False,
+        Scales=None,
+        numberOfSpatialSamples=3000,
     ):
         """Create Elastix parameter file from scratch (so we don't have to mess with the XML presets or other things)"""  # TODO: add kwargs type argument to allow arbitrary modifications to the parameters
         p = {}
@@ -851,7 +2506,7 @@ class PerfusionHelperLogic(ScriptedLoadableModuleLogic):
             p["Scales"] = Scales  # 5000 is a good choice
         p["NumberOfHistogramBins"] = 64
         p["MaximumNumberOfIterations"] = 1000
-        p["NumberOfSpatialSamples"] = 3000
+        p["NumberOfSpatialSamples"] = numberOfSpatialSamples
         if prealigned:
             p["AutomaticTransformInitialization"] = "false"
         else:
@@ -918,6 +2573,493 @@ class PerfusionHelperLogic(ScriptedLoadableModuleLogic):
         print(msg)
 
 
+#
+# PerfusionHelperPipeline
+#
+
+
+class PerfusionHelperPipeline:
+    """Make-style runner for the module workflow (gather tags, sequence registration, transfer
+    tags, T1 registration) with its inputs taken from the module parameter node.
+    When a stage runs, a fingerprint of its input nodes (modification times of their contents) and
+    of its parameters is recorded. run() then only executes the stages whose fingerprint changed or
+    whose outputs are missing; stages that modify nodes used by later stages make those stale too.
+    """
+
+    STAGES = ["GatherTags", "SequenceRegistration", "TransferTags", "T1Registration"]
+    # Parameter node parameters that each stage depends on
+    STAGE_PARAMETERS = {
+        "GatherTags": [],
+        "SequenceRegistration": [
+            "SequenceRegistrationStrategy",
+            "AutoReferenceFrameChecked",
+            "SequenceRegBrainMaskChecked",
+        ],
+        "TransferTags": [],
+        "T1Registration": ["RegistrationStrategy", "HardenTransformChecked"],
+    }
+
+    def __init__(self, logic, parameterNode):
+        self.logic = logic
+        self.parameterNode = parameterNode
+        # stage name -> (input fingerprint, output node IDs) after its last run
+        self.stageRecords = {}
+        self.referenceFrame = None
+
+    def stageInputNodes(self, stageName):
+        """Return the input nodes of a stage as a dictionary of (role, includeAttributes) -> node.
+        Attributes only matter where a stage reads them."""
+        pn = self.parameterNode
+        if stageName == "GatherTags":
+            return {("input", False): pn.GetNodeReference("GatherTagsInputSequence")}
+        if stageName == "SequenceRegistration":
+            inputs = {("input", False): pn.GetNodeReference("InputRegisteredSequence")}
+            if pn.GetParameter("SequenceRegBrainMaskChecked") == "1":
+                inputs[("mask", False)] = pn.GetNodeReference("SequenceRegBrainMask")
+            return inputs
+        if stageName == "TransferTags":
+            return {
+                ("source", True): pn.GetNodeReference("TransferTagsInputSequence"),
+                ("destination", False): pn.GetNodeReference(
+                    "TransferTagsDestinationSequence"
+                ),
+            }
+        if stageName == "T1Registration":
+            return {
+                ("T1", False): pn.GetNodeReference("T1Node"),
+                ("mask", False): pn.GetNodeReference("T1BrainMask"),
+                ("sequence", False): pn.GetNodeReference("T1RegSequenceInput"),
+            }
+        raise ValueError("Unknown pipeline stage " + stageName)
+
+    def stageOutputReferences(self, stageName):
+        return {
+            "GatherTags": [],
+            "SequenceRegistration": ["OutputRegisteredSequence"],
+            "TransferTags": [],
+            "T1Registration": ["T1RegTransform"],
+        }[stageName]
+
+    def isStageConfigured(self, stageName):
+        """Return True if all required inputs of the stage are selected."""
+        required = {
+            "GatherTags": ["input"],
+            "SequenceRegistration": ["input"],
+            "TransferTags": ["source", "destination"],
+            "T1Registration": ["T1", "sequence"],
+        }[stageName]
+        inputs = {
+            role: node for (role, attributes), node in self.stageInputNodes(stageName).items()
+        }
+        return all(inputs.get(role) is not None for role in required)
+
+    def nodeFingerprint(self, node, includeAttributes=False):
+        """Fingerprint of the content of a node. Sequences are fingerprinted by their data nodes,
+        so that adding tags to a sequence does not make its registration stale."""
+        if node is None:
+            return None
+        if node.IsA("vtkMRMLSequenceNode"):
+            fingerprint = [node.GetID(), node.GetNumberOfDataNodes()]
+            for itemNumber in range(node.GetNumberOfDataNodes()):
+                fingerprint.append(node.GetNthIndexValue(itemNumber))
+                fingerprint.append(
+                    self.nodeFingerprint(node.GetNthDataNode(itemNumber))
+                )
+        else:
+            fingerprint = [node.GetID(), node.GetMTime()]
+            if node.IsA("vtkMRMLVolumeNode") and node.GetImageData():
+                fingerprint.append(node.GetImageData().GetMTime())
+        if includeAttributes:
+            fingerprint.append(
+                tuple(
+                    (attrName, node.GetAttribute(attrName))
+                    for attrName in sorted(node.GetAttributeNames())
+                )
+            )
+        return tuple(fingerprint)
+
+    def stageFingerprint(self, stageName):
+        inputs = self.stageInputNodes(stageName)
+        return (
+            tuple(
+                (role, self.nodeFingerprint(node, includeAttributes))
+                for (role, includeAttributes), node in sorted(inputs.items())
+            ),
+            tuple(
+                (name, self.parameterNode.GetParameter(name))
+                for name in self.STAGE_PARAMETERS[stageName]
+            ),
+            self.stageStateFingerprint(stageName),
+        )
+
+    def stageStateFingerprint(self, stageName):
+        """Fingerprint of scene state other than node contents that a stage depends on. T1
+        registration registers to the sequence frame that is currently shown by its browser."""
+        if stageName != "T1Registration":
+            return None
+        seqNode = self.parameterNode.GetNodeReference("T1RegSequenceInput")
+        if seqNode is None:
+            return None
+        browserNode = (
+            slicer.modules.sequences.logic().GetFirstBrowserNodeForSequenceNode(seqNode)
+        )
+        if browserNode is None:
+            return None
+        return (browserNode.GetID(), browserNode.GetSelectedItemNumber())
+
+    def isStageStale(self, stageName):
+        record = self.stageRecords.get(stageName)
+        if record is None:
+            return True
+        fingerprint, outputNodeIDs = record
+        for nodeID in outputNodeIDs:
+            if slicer.mrmlScene.GetNodeByID(nodeID) is None:
+                return True
+        return fingerprint != self.stageFingerprint(stageName)
+
+    def runStage(self, stageName):
+        """Run a stage unconditionally and record its fingerprint."""
+        getattr(self, "run" + stageName)()
+        # Recorded after running, because stages modify some of their inputs (tags, transforms)
+        outputNodeIDs = [
+            self.parameterNode.GetNodeReferenceID(reference)
+            for reference in self.stageOutputReferences(stageName)
+        ]
+        self.stageRecords[stageName] = (
+            self.stageFingerprint(stageName),
+            [nodeID for nodeID in outputNodeIDs if nodeID],
+        )
+
+    def run(self, force=False):
+        """Run the stages that are stale (all configured stages if force is set), in workflow
+        order. Returns a list of (stage name, "ran"/"up to date"/"not configured")."""
+        results = []
+        for stageName in self.STAGES:
+            if not self.isStageConfigured(stageName):
+                results.append((stageName, "not configured"))
+            elif force or self.isStageStale(stageName):
+                self.runStage(stageName)
+                results.append((stageName, "ran"))
+            else:
+                results.append((stageName, "up to date"))
+        logging.info("Pipeline run: %s" % results)
+        return results
+
+    def runGatherTags(self):
+        seqNode = self.parameterNode.GetNodeReference("GatherTagsInputSequence")
+        errorCode, errorMsg = self.logic.gatherTagsFromDICOMTag(seqNode)
+        if errorCode > 0:
+            raise Exception(errorMsg)
+
+    def runSequenceRegistration(self):
+        pn = self.parameterNode
+        inputSequence = pn.GetNodeReference("InputRegisteredSequence")
+        outputSequence = pn.GetNodeReference("OutputRegisteredSequence")
+        if outputSequence is None:
+            outputSequence = self.logic.newNode(
+                "vtkMRMLSequenceNode", "RegisteredSequence"
+            )
+            pn.SetNodeReferenceID("OutputRegisteredSequence", outputSequence.GetID())
+        outputTransformSequence = None  # TODO add selector for this
+        if pn.GetParameter("AutoReferenceFrameChecked") == "1":
+            self.referenceFrame = self.logic.selectReferenceFrame(inputSequence)
+        else:
+            self.referenceFrame = 0
+        useBrainMask = pn.GetParameter("SequenceRegBrainMaskChecked") == "1"
+        brainMaskNode = (
+            pn.GetNodeReference("SequenceRegBrainMask") if useBrainMask else None
+        )
+        if useBrainMask and brainMaskNode is None:
+            # Keep the created mask selected, so that it can be reviewed and is reused by reruns
+            brainMaskNode = self.logic.createBrainMaskFromVolume(
+                inputSequence.GetNthDataNode(self.referenceFrame),
+                inputSequence.GetName() + "_BrainMask",
+            )
+            pn.SetNodeReferenceID("SequenceRegBrainMask", brainMaskNode.GetID())
+        self.logic.runSequenceRegistration(
+            inputSequence,
+            outputSequence,
+            outputTransformSequence,
+            pn.GetParameter("SequenceRegistrationStrategy"),
+            fixedVolumeItemNumber=self.referenceFrame,
+            fixedVolumeMaskNode=brainMaskNode,
+        )
+        # Tags go to the registered version, which is the suggested sequence for T1 registration
+        pn.SetNodeReferenceID("TransferTagsInputSequence", inputSequence.GetID())
+        pn.SetNodeReferenceID("TransferTagsDestinationSequence", outputSequence.GetID())
+        pn.SetNodeReferenceID("T1RegSequenceInput", outputSequence.GetID())
+
+    def runTransferTags(self):
+        destNode = self.parameterNode.GetNodeReference("TransferTagsDestinationSequence")
+        self.logic.transferTags(
+            self.parameterNode.GetNodeReference("TransferTagsInputSequence"), destNode
+        )
+        # The tagged destination is the sequence that is analyzed next by DSCMRIAnalysis
+        self.logic.updateLegacyFrameAttributes(destNode)
+
+    def runT1Registration(self):
+        pn = self.parameterNode
+        T1node = pn.GetNodeReference("T1Node")
+        brainMaskNode = pn.GetNodeReference("T1BrainMask")
+        outputTransformNode = self.logic.registerT1ToSequence(
+            T1node,
+            pn.GetNodeReference("T1RegSequenceInput"),
+            brainMaskNode,
+            pn.GetNodeReference("T1RegTransform"),
+            pn.GetParameter("RegistrationStrategy"),
+        )
+        # Set output transform node (in case it was just created)
+        pn.SetNodeReferenceID("T1RegTransform", outputTransformNode.GetID())
+        self.logic.applyT1RegistrationTransform(
+            T1node,
+            brainMaskNode,
+            outputTransformNode,
+            harden=pn.GetParameter("HardenTransformChecked") == "1",
+        )
+
+
+#
+# RegistrationJobScheduler
+#
+
+
+class ElastixRegistrationJob:
+    """One Elastix run, executed as a subprocess by RegistrationJobScheduler.
+    arguments are the elastix command line arguments without "-threads", which is added by the
+    scheduler. Relative paths in arguments are relative to workingDirectory. Process output goes to logFilePath (discarded if None). onFinished(job) is called
+    after the process completed successfully.
+    """
+
+    def __init__(
+        self,
+        executablePath,
+        arguments,
+        env=None,
+        logFilePath=None,
+        onFinished=None,
+        workingDirectory=None,
+    ):
+        self.executablePath = executablePath
+        self.arguments = arguments
+        self.env = env
+        self.logFilePath = logFilePath
+        self.onFinished = onFinished
+        self.workingDirectory = workingDirectory
+        self.process = None
+        self.numberOfThreads = None
+        # time.perf_counter() when the process was started and when its completion was noticed
+        self.startTime = None
+        self.finishTime = None
+        self._logFile = None
+
+    def start(self, numberOfThreads, cpuSet=None):
+        import subprocess
+        import sys
+        import time
+
+        self.numberOfThreads = numberOfThreads
+        self.startTime = time.perf_counter()
+        commandLine = (
+            [self.executablePath]
+            + list(self.arguments)
+            + ["-threads", str(numberOfThreads)]
+        )
+        logging.info("Starting elastix: " + repr(commandLine))
+        if self.logFilePath:
+            self._logFile = open(self.logFilePath, "w")
+            stdout = self._logFile
+        else:
+            stdout = subprocess.DEVNULL
+        popenArgs = {}
+        if sys.platform == "win32":
+            # Do not open a console window for each process
+            popenArgs["creationflags"] = subprocess.CREATE_NO_WINDOW
+        self.process = subprocess.Popen(
+            commandLine,
+            env=self.env,
+            cwd=self.workingDirectory,
+            stdout=stdout,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            **popenArgs,
+        )
+        if cpuSet and hasattr(os, "sched_setaffinity"):
+            try:
+                os.sched_setaffinity(self.process.pid, cpuSet)
+            except OSError as e:
+                logging.warning("Could not pin elastix process to cores: %s" % e)
+
+    def isRunning(self):
+        return self.process.poll() is None
+
+    def cancel(self):
+        if self.process is not None and self.isRunning():
+            self.process.kill()
+            self.process.wait()
+        if self._logFile:
+            self._logFile.close()
+            self._logFile = None
+
+    def finish(self):
+        import time
+
+        self.finishTime = time.perf_counter()
+        if self._logFile:
+            self._logFile.close()
+            self._logFile = None
+        if self.process.returncode != 0:
+            raise Exception(
+                "Elastix failed with return code %i, see %s"
+                % (self.process.returncode, self.logFilePath)
+            )
+        if self.onFinished:
+            self.onFinished(self)
+
+
+class BrainsRegistrationJob:
+    """One BRAINSFit run, executed as an asynchronous CLI by RegistrationJobScheduler.
+    parameters is the CLI parameter dictionary without "numberOfThreads", which is set by the
+    scheduler. CLI modules are started by Slicer's process manager, so they cannot be pinned to cores.
+    onFinished(job) is called after the CLI completed successfully.
+    """
+
+    def __init__(self, parameters, onFinished=None):
+        self.parameters = parameters
+        self.onFinished = onFinished
+        self.cliNode = None
+        self.numberOfThreads = None
+
+    def start(self, numberOfThreads, cpuSet=None):
+        self.numberOfThreads = numberOfThreads
+        parameters = dict(self.parameters)
+        parameters["numberOfThreads"] = int(numberOfThreads)
+        self.cliNode = slicer.cli.run(
+            slicer.modules.brainsfit,
+            None,
+            parameters=parameters,
+            wait_for_completion=False,
+        )
+
+    def isRunning(self):
+        return self.cliNode.IsBusy()
+
+    def cancel(self):
+        if self.cliNode is None:
+            return
+        if self.isRunning():
+            self.cliNode.Cancel()
+        slicer.mrmlScene.RemoveNode(self.cliNode)
+        self.cliNode = None
+
+    def finish(self):
+        cliNode = self.cliNode
+        status = cliNode.GetStatus()
+        errorText = cliNode.GetErrorText()
+        slicer.mrmlScene.RemoveNode(cliNode)
+        if status & cliNode.ErrorsMask:
+            raise Exception("BRAINSFit failed: " + errorText)
+        if status != cliNode.Completed:
+            raise Exception("BRAINSFit was cancelled")
+        if self.onFinished:
+            self.onFinished(self)
+
+
+class RegistrationJobScheduler:
+    """Run registration jobs (ElastixRegistrationJob, BrainsRegistrationJob) concurrently within a
+    fixed core budget. Each started job gets an explicit thread count so that the running jobs
+    never use more than coreBudget cores together; jobs that do not fit are queued until cores are
+    released. With pinToCores, each process is restricted to its own set of cores (where the OS
+    supports it), which keeps concurrent jobs from evicting each other's caches.
+    """
+
+    def __init__(self, coreBudget=None, maxConcurrentJobs=None, pinToCores=False):
+        if hasattr(os, "sched_getaffinity"):
+            availableCores = sorted(os.sched_getaffinity(0))
+        else:
+            availableCores = list(range(os.cpu_count() or 1))
+        if coreBudget is None:
+            coreBudget = len(availableCores)
+        self.coreBudget = max(1, min(int(coreBudget), len(availableCores)))
+        self.maxConcurrentJobs = maxConcurrentJobs or self.coreBudget
+        self.pinToCores = pinToCores
+        self._freeCores = availableCores[: self.coreBudget]
+        self._queuedJobs = []
+        self._runningJobs = {}  # job -> list of cores allocated to it
+
+    def submit(self, job):
+        self._queuedJobs.append(job)
+
+    def hasJobs(self):
+        return bool(self._queuedJobs or self._runningJobs)
+
+    def numberOfRunningJobs(self):
+        return len(self._runningJobs)
+
+    def numberOfQueuedJobs(self):
+        return len(self._queuedJobs)
+
+    def startQueuedJobs(self, numberOfUpcomingJobs=0):
+        """Start as many queued jobs as the core budget allows. The cores are shared evenly between
+        all jobs that can run at the same time, including numberOfUpcomingJobs jobs that are not
+        submitted yet (so that the first submitted job does not take all the cores)."""
+        while (
+            self._queuedJobs
+            and self._freeCores
+            and len(self._runningJobs) < self.maxConcurrentJobs
+        ):
+            concurrentJobs = min(
+                self.maxConcurrentJobs,
+                len(self._runningJobs) + len(self._queuedJobs) + numberOfUpcomingJobs,
+            )
+            # Share the free cores between the jobs that are about to start
+            numberOfThreads = max(
+                1, len(self._freeCores) // (concurrentJobs - len(self._runningJobs))
+            )
+            cores = self._freeCores[:numberOfThreads]
+            self._freeCores = self._freeCores[numberOfThreads:]
+            job = self._queuedJobs.pop(0)
+            try:
+                job.start(numberOfThreads, cores if self.pinToCores else None)
+            except Exception:
+                self._freeCores += cores
+                raise
+            self._runningJobs[job] = cores
+
+    def pollJobs(self):
+        """Release the cores of completed jobs, call their finish() and return them.
+        If a job failed, all other jobs are cancelled and the error is raised."""
+        # CLI node status is only updated while the event loop runs
+        slicer.app.processEvents()
+        finishedJobs = []
+        for job in list(self._runningJobs.keys()):
+            if job.isRunning():
+                continue
+            self._freeCores += self._runningJobs.pop(job)
+            try:
+                job.finish()
+            except Exception:
+                self.cancelAll()
+                raise
+            finishedJobs.append(job)
+        return finishedJobs
+
+    def cancelAll(self):
+        self._queuedJobs = []
+        for job, cores in self._runningJobs.items():
+            job.cancel()
+            self._freeCores += cores
+        self._runningJobs = {}
+
+    def runUntilDone(self, pollInterval=0.01):
+        """Start queued jobs and wait until all of them completed."""
+        import time
+
+        while self.hasJobs():
+            self.startQueuedJobs()
+            if not self.pollJobs():
+                time.sleep(pollInterval)
+
+
 #
 # PerfusionHelperTest
 #
@@ -937,51 +3079,640 @@ class PerfusionHelperTest(ScriptedLoadableModuleTest):
     def runTest(self):
         """Run as few or as many tests as needed here."""
         self.setUp()
-        self.test_PerfusionHelper1()
+        self.test_ModuleImportTime()
+        self.setUp()
+        self.test_SharedDirectoryRegistrationWorkers()
+        self.setUp()
+        self.test_TransferTagsPerformance()
+        self.setUp()
+        self.test_CreateElastixParameterFilePerformance()
+        self.setUp()
+        self.test_ImportElastixTransformPerformance()
+        self.setUp()
+        self.test_ElastixRegistrationPerformance()
+        self.setUp()
+        self.test_GatherTagsFromDICOMTagPerformance()
+
+    # Benchmark run by test_ModuleImportTime in a fresh Slicer process
+    IMPORT_BENCHMARK_CODE = """
+import importlib.util, json, sys, time
+import slicer, slicer.util, slicer.ScriptedLoadableModule
+heavyModules = %(heavyModules)r
+loadedBefore = [name for name in heavyModules if name in sys.modules]
+spec = importlib.util.spec_from_file_location("PerfusionHelperImportBenchmark", %(modulePath)r)
+startTime = time.perf_counter()
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+importTime = time.perf_counter() - startTime
+startTime = time.perf_counter()
+logic = module.getPerfusionHelperLogic()
+firstLogicTime = time.perf_counter() - startTime
+startTime = time.perf_counter()
+sameLogic = module.getPerfusionHelperLogic() is logic
+sharedLogicTime = time.perf_counter() - startTime
+with open(%(resultFilePath)r, "w") as f:
+    json.dump({
+        "importTime": importTime,
+        "firstLogicTime": firstLogicTime,
+        "sharedLogicTime": sharedLogicTime,
+        "sameLogic": sameLogic,
+        "loadedBefore": loadedBefore,
+        "imported": [name for name in heavyModules if name in sys.modules and name not in loadedBefore],
+    }, f)
+slicer.util.exit(0)
+"""
 
-    def test_PerfusionHelper1(self):
-        """Ideally you should have several levels of tests.  At the lowest level
-        tests should exercise the functionality of the logic with different inputs
-        (both valid and invalid).  At higher levels your tests should emulate the
-        way the user would interact with your code and confirm that it still works
-        the way you intended.
-        One of the most important features of the tests is that it should alert other
-        developers when their changes will have an impact on the behavior of your
-        module.  For example, if a developer removes a feature that you depend on,
-        your test should break so they know that the feature is needed.
+    def test_ModuleImportTime(self):
+        """Benchmark loading the module file and the first use of the shared logic. Loading the
+        module must not import the heavy modules that are only needed by some features.
+        This runs in a fresh Slicer process without scripted modules, because in this process the
+        scripted module factory has already imported Elastix and SequenceRegistration.
         """
+        import json
+        import subprocess
+        import tempfile
+
+        self.delayDisplay("Benchmarking module import time")
+        budgetScale = float(os.environ.get("PERFUSIONHELPER_BUDGET_SCALE", "1"))
+        heavyModules = ["Elastix", "SequenceRegistration", "pydicom"]
+        slicerExecutable = (
+            slicer.app.launcherExecutableFilePath or slicer.app.applicationFilePath()
+        )
+        with tempfile.TemporaryDirectory() as tempDir:
+            resultFilePath = os.path.join(tempDir, "importBenchmark.json")
+            benchmarkCode = self.IMPORT_BENCHMARK_CODE % {
+                "heavyModules": heavyModules,
+                "modulePath": slicer.modules.perfusionhelper.path,
+                "resultFilePath": resultFilePath,
+            }
+            subprocess.run(
+                [
+                    slicerExecutable,
+                    "--no-splash",
+                    "--no-main-window",
+                    "--disable-scripted-loadable-modules",
+                    "--disable-cli-modules",
+                    "--python-code",
+                    benchmarkCode,
+                ],
+                timeout=300,
+            )
+            self.assertTrue(
+                os.path.exists(resultFilePath), "Import benchmark process failed"
+            )
+            with open(resultFilePath) as f:
+                results = json.load(f)
+        logging.info(
+            "PerfusionHelper import: %.1f ms, first logic access: %.1f ms, shared logic access: %.3f ms"
+            % (
+                results["importTime"] * 1000,
+                results["firstLogicTime"] * 1000,
+                results["sharedLogicTime"] * 1000,
+            )
+        )
+        # Scripted modules are disabled, so these must not have been loaded at startup
+        self.assertNotIn("Elastix", results["loadedBefore"])
+        self.assertNotIn("SequenceRegistration", results["loadedBefore"])
+        self.assertEqual(results["imported"], [])
+        self.assertTrue(results["sameLogic"])
+        self.assertLess(results["importTime"], 0.5 * budgetScale)
+        self.assertLess(results["firstLogicTime"], 0.1 * budgetScale)
+        self.delayDisplay("Test passed")
 
-        self.delayDisplay("Starting the test")
+    # Baselines of the benchmarked operations on the test fixtures, which are sized so that each
+    # takes tens of milliseconds: median wall time (s) of PERFORMANCE_REPETITIONS runs, peak traced
+    # Python memory (bytes) and peak resident memory growth (bytes), typical of several processes.
+    # They were recorded on a Linux workstation outside Slicer, with Python stand-ins for the MRML
+    # nodes and the DICOM database. Set PERFUSIONHELPER_RECORD_BASELINES=1 to log the values
+    # measured on this machine in this form instead of checking them (to record them in Slicer),
+    # and PERFUSIONHELPER_BUDGET_SCALE to scale the time budgets on slow machines.
+    PERFORMANCE_BASELINES = {
+        "transferTags": (0.027, 41927, 0),
+        "createElastixParameterFile": (0.022, 41842, 0),
+        "importElastixTransform": (0.033, 112098, 4096),
+        "gatherTagsFromDICOMTag": (0.028, 98946, 0),
+        "runElastixRegistration": (0.019, 57409, 8192),
+    }
+    PERFORMANCE_REPETITIONS = 20
+    # A measurement fails if it exceeds its baseline times PERFORMANCE_TOLERANCE. Resident memory
+    # growth below the traced Python memory of the operation is allocator noise.
+    PERFORMANCE_TOLERANCE = 3.0
+
+    def measurePeakResidentMemoryGrowth(self, function):
+        """Run function and return how much the peak resident memory of the process grew over the
+        resident memory before the call (in bytes), which includes allocations of the C++ libraries,
+        and the result of function. The growth is None where it cannot be measured: the peak
+        can only be reset on Linux."""
+        def readStatus(fieldName):
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith(fieldName + ":"):
+                        return int(line.split()[1]) * 1024
+            return None
+
+        try:
+            # Writing "5" resets the peak resident memory (VmHWM) to the current resident memory
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+            residentMemoryBefore = readStatus("VmRSS")
+        except OSError:
+            return None, function()
+        result = function()
+        peakResidentMemory = readStatus("VmHWM")
+        if residentMemoryBefore is None or peakResidentMemory is None:
+            return None, result
+        return max(peakResidentMemory - residentMemoryBefore, 0), result
+
+    def assertWithinPerformanceBaseline(self, operationName, function):
+        """Run function once to warm up, PERFORMANCE_REPETITIONS times timed, once with Python memory
+        tracing and once measuring the resident memory, and fail if the median wall time or a peak
+        memory exceeds the baseline of operationName (see PERFORMANCE_BASELINES) by more than
+        PERFORMANCE_TOLERANCE. Returns the result of the last run."""
+        import statistics
+        import time
+        import tracemalloc
+
+        baselineTime, baselineTracedMemory, baselineResidentMemory = self.PERFORMANCE_BASELINES[
+            operationName
+        ]
+        timeBudget = (
+            baselineTime
+            * self.PERFORMANCE_TOLERANCE
+            * float(os.environ.get("PERFUSIONHELPER_BUDGET_SCALE", "1"))
+        )
+        tracedMemoryBudget = baselineTracedMemory * self.PERFORMANCE_TOLERANCE
+        residentMemoryBudget = (
+            max(baselineResidentMemory, baselineTracedMemory) * self.PERFORMANCE_TOLERANCE
+        )
+        function()
+        elapsedTimes = []
+        for _ in range(self.PERFORMANCE_REPETITIONS):
+            startTime = time.perf_counter()
+            function()
+            elapsedTimes.append(time.perf_counter() - startTime)
+        medianTime = statistics.median(elapsedTimes)
+        # Measured separately, because tracing slows down allocations
+        tracemalloc.start()
+        try:
+            function()
+            _, tracedMemory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        residentMemory, result = self.measurePeakResidentMemoryGrowth(function)
+        logging.info(
+            "%s: median %.3f ms (baseline %.3f ms, budget %.3f ms), traced memory %.1f kB"
+            " (baseline %.1f kB), resident memory growth %s (baseline %.1f kB)"
+            % (
+                operationName,
+                medianTime * 1000,
+                baselineTime * 1000,
+                timeBudget * 1000,
+                tracedMemory / 1000,
+                baselineTracedMemory / 1000,
+                "not measured" if residentMemory is None else "%.1f kB" % (residentMemory / 1000),
+                baselineResidentMemory / 1000,
+            )
+        )
+        if os.environ.get("PERFUSIONHELPER_RECORD_BASELINES"):
+            logging.info(
+                '"%s": (%.2g, %i, %s),'
+                % (operationName, medianTime, tracedMemory, residentMemory)
+            )
+            return result
+        self.assertLess(medianTime, timeBudget, operationName + " is slower than its baseline")
+        self.assertLess(
+            tracedMemory,
+            tracedMemoryBudget,
+            operationName + " allocates more Python memory than its baseline",
+        )
+        if residentMemory is not None:
+            self.assertLess(
+                residentMemory,
+                residentMemoryBudget,
+                operationName + " uses more resident memory than its baseline",
+            )
+        return result
+
+    def createTestSequence(self, numberOfFrames, dimensions=(16, 16, 4), frameAttributes=None):
+        """Create a sequence of numberOfFrames small volumes in the scene, with a browser node so
+        that it has a proxy node. frameAttributes(itemNumber) returns the attributes of a frame."""
+        seqNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode", "TestSequence")
+        for itemNumber in range(numberOfFrames):
+            imageData = vtk.vtkImageData()
+            imageData.SetDimensions(dimensions)
+            imageData.AllocateScalars(vtk.VTK_SHORT, 1)
+            frame = slicer.vtkMRMLScalarVolumeNode()
+            frame.SetAndObserveImageData(imageData)
+            for name, value in (frameAttributes(itemNumber) if frameAttributes else {}).items():
+                frame.SetAttribute(name, value)
+            seqNode.SetDataNodeAtValue(frame, str(itemNumber))
+        browserNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceBrowserNode")
+        browserNode.SetAndObserveMasterSequenceNodeID(seqNode.GetID())
+        slicer.modules.sequences.logic().UpdateProxyNodesFromSequences(browserNode)
+        return seqNode
+
+    def writeDICOMFixture(self, directory, numberOfFrames):
+        """Write one small DSC MR DICOM file per frame to directory, return their SOP instance UIDs."""
+        import pydicom
+        from pydicom.dataset import FileDataset, FileMetaDataset
+        from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+        studyUID = generate_uid()
+        seriesUID = generate_uid()
+        instanceUIDs = []
+        for itemNumber in range(numberOfFrames):
+            instanceUID = generate_uid()
+            fileMeta = FileMetaDataset()
+            fileMeta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"  # MR Image Storage
+            fileMeta.MediaStorageSOPInstanceUID = instanceUID
+            fileMeta.TransferSyntaxUID = ExplicitVRLittleEndian
+            filePath = os.path.join(directory, "frame%04i.dcm" % itemNumber)
+            ds = FileDataset(filePath, {}, file_meta=fileMeta, preamble=b"\0" * 128)
+            if int(pydicom.__version__.split(".")[0]) < 3:
+                ds.is_little_endian = True
+                ds.is_implicit_VR = False
+            ds.SOPClassUID = fileMeta.MediaStorageSOPClassUID
+            ds.SOPInstanceUID = instanceUID
+            ds.StudyInstanceUID = studyUID
+            ds.SeriesInstanceUID = seriesUID
+            ds.PatientName = "PerfusionHelper^Test"
+            ds.PatientID = "PerfusionHelperTest"
+            ds.Modality = "MR"
+            ds.SeriesNumber = 1
+            ds.InstanceNumber = itemNumber + 1
+            ds.EchoTime = 30.0
+            ds.FlipAngle = 60.0
+            ds.RepetitionTime = 1500.0
+            ds.Rows = 16
+            ds.Columns = 16
+            ds.SamplesPerPixel = 1
+            ds.PhotometricInterpretation = "MONOCHROME2"
+            ds.BitsAllocated = 16
+            ds.BitsStored = 16
+            ds.HighBit = 15
+            ds.PixelRepresentation = 1
+            ds.PixelData = bytes(16 * 16 * 2)
+            ds.save_as(filePath)
+            instanceUIDs.append(instanceUID)
+        return instanceUIDs
+
+    def writeElastixTransformFixture(self, fixtureDir):
+        """Write a two-stage elastix result (translation, then Euler rotation) to fixtureDir, see
+        expectedElastixTransformFixtureMatrix."""
+        with open(os.path.join(fixtureDir, "TransformParameters.0.txt"), "w") as f:
+            f.write(
+                '(Transform "TranslationTransform")\n'
+                "(NumberOfParameters 3)\n"
+                "(TransformParameters 1.0 2.0 3.0)\n"
+                '(InitialTransformParametersFileName "NoInitialTransform")\n'
+                "(FixedImageDimension 3)\n"
+            )
+        with open(os.path.join(fixtureDir, "TransformParameters.1.txt"), "w") as f:
+            # elastix refers to the initial transform by absolute path; this one does not
+            # exist anymore, as if the result directory had been moved
+            f.write(
+                '(Transform "EulerTransform")\n'
+                "(NumberOfParameters 6)\n"
+                "(TransformParameters 0.0 0.0 0.1 0.0 0.0 0.0)\n"
+                "(CenterOfRotationPoint 10.0 20.0 30.0)\n"
+                '(InitialTransformParametersFileName "%s")\n'
+                '(HowToCombineTransforms "Compose")\n'
+                "(FixedImageDimension 3)\n"
+                % os.path.join(fixtureDir, "moved", "TransformParameters.0.txt")
+            )
 
-        # Get/create input data
+    def expectedElastixTransformFixtureMatrix(self):
+        """Transform from parent (RAS) matrix of the result written by writeElastixTransformFixture:
+        Euler rotation about the center, after the translation."""
+        import numpy as np
+
+        c, s = np.cos(0.1), np.sin(0.1)
+        rotation = np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+        center = np.array([10.0, 20.0, 30.0])
+        euler = np.eye(4)
+        euler[0:3, 0:3] = rotation
+        euler[0:3, 3] = center - rotation @ center
+        translation = np.eye(4)
+        translation[0:3, 3] = [1.0, 2.0, 3.0]
+        lpsToRas = np.diag([-1.0, -1.0, 1.0, 1.0])
+        return lpsToRas @ euler @ translation @ lpsToRas
+
+    def writeStubElastix(self, directory, fixtureDir, runTime=0):
+        """Write a stub elastix executable that, instead of registering, waits runTime seconds,
+        appends its process ID to elastix_runs.txt in its working directory and copies the transform
+        parameter files of fixtureDir to its -out directory."""
+        stubPath = os.path.join(directory, "elastix")
+        with open(stubPath, "w") as f:
+            f.write(
+                "#!/bin/sh\n"
+                'while [ $# -gt 0 ]; do\n'
+                '  if [ "$1" = "-out" ]; then out="$2"; fi\n'
+                "  shift\n"
+                "done\n"
+                "sleep %g\n"
+                "echo $$ >> elastix_runs.txt\n"
+                'cp "%s"/TransformParameters.*.txt "$out"/\n' % (runTime, fixtureDir)
+            )
+        os.chmod(stubPath, 0o755)
+        return stubPath
 
-        import SampleData
+    def createTestVolume(self, name, dimensions=(32, 32, 8)):
+        """Create a scalar volume with random voxels in the scene."""
+        import numpy as np
 
-        registerSampleData()
-        inputVolume = SampleData.downloadSample("PerfusionHelper1")
-        self.delayDisplay("Loaded test data set")
+        volumeNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", name)
+        volumeNode.SetSpacing(1.5, 1.5, 5.0)
+        voxels = np.random.default_rng(0).integers(
+            0, 1000, size=dimensions[::-1], dtype=np.int16
+        )
+        slicer.util.updateVolumeFromArray(volumeNode, voxels)
+        return volumeNode
+
+    def test_SharedDirectoryRegistrationWorkers(self):
+        """Run several RegistrationWorker processes with a stub elastix on a shared directory, where
+        one job was claimed by a worker that died. Every job must run exactly once and all results
+        must be imported."""
+        import shutil
+        import subprocess
+        import sys
+        import tempfile
+
+        import numpy as np
+
+        if os.name == "nt":
+            logging.info("Skipping shared directory worker test, the stub elastix is a shell script")
+            return
+        self.delayDisplay("Testing shared directory registration workers")
+        logic = PerfusionHelperLogic()
+        numberOfWorkers = 3
+        numberOfJobs = 12
+        workerScriptPath = os.path.join(
+            os.path.dirname(slicer.modules.perfusionhelper.path),
+            "PerfusionHelperLib",
+            "RegistrationWorker.py",
+        )
+        pythonExecutable = (
+            shutil.which(
+                "PythonSlicer", path=os.path.dirname(slicer.app.applicationFilePath())
+            )
+            or shutil.which("PythonSlicer")
+            or sys.executable
+        )
+        fixedVolume = self.createTestVolume("Fixed")
+        movingVolume = self.createTestVolume("Moving")
+        with tempfile.TemporaryDirectory() as tempDir:
+            fixtureDir = os.path.join(tempDir, "fixture")
+            os.makedirs(fixtureDir)
+            self.writeElastixTransformFixture(fixtureDir)
+            stubPath = self.writeStubElastix(tempDir, fixtureDir, runTime=0.1)
+            sharedDir = os.path.join(tempDir, "shared")
+            jobTransformNodes = {}
+            for jobIndex in range(numberOfJobs):
+                jobId = logic.submitElastixRegistrationJobToSharedDirectory(
+                    sharedDir, fixedVolume, movingVolume, jobName="job%02i" % jobIndex
+                )
+                jobTransformNodes[jobId] = slicer.mrmlScene.AddNewNodeByClass(
+                    "vtkMRMLLinearTransformNode"
+                )
+            # A worker that died right after claiming the job
+            deadWorkerJobId = sorted(jobTransformNodes)[0]
+            with open(os.path.join(sharedDir, deadWorkerJobId, "job.lock"), "w") as f:
+                f.write("deadhost 1 deadtoken\n")
+            workers = [
+                subprocess.Popen(
+                    [
+                        pythonExecutable,
+                        workerScriptPath,
+                        sharedDir,
+                        "--elastix",
+                        stubPath,
+                        "--poll-interval",
+                        "0.05",
+                        "--heartbeat-interval",
+                        "0.2",
+                    ]
+                )
+                for workerIndex in range(numberOfWorkers)
+            ]
+            importedJobIds = []
+            try:
+                logic.collectSharedDirectoryRegistrationResults(
+                    sharedDir,
+                    jobTransformNodes,
+                    onJobImported=lambda jobId, transformNode: importedJobIds.append(jobId),
+                    timeout=60,
+                    pollInterval=0.05,
+                    staleLockTimeout=1.0,
+                    heartbeatInterval=0.2,
+                )
+            finally:
+                for worker in workers:
+                    worker.terminate()
+                    worker.wait()
+            for jobId in jobTransformNodes:
+                with open(os.path.join(sharedDir, jobId, "elastix_runs.txt")) as f:
+                    self.assertEqual(
+                        len(f.read().split()), 1, "Job %s did not run exactly once" % jobId
+                    )
+        self.assertEqual(sorted(importedJobIds), sorted(jobTransformNodes))
+        expectedMatrix = self.expectedElastixTransformFixtureMatrix()
+        for transformNode in jobTransformNodes.values():
+            transformFromParent = vtk.vtkMatrix4x4()
+            transformNode.GetMatrixTransformFromParent(transformFromParent)
+            np.testing.assert_allclose(
+                slicer.util.arrayFromVTKMatrix(transformFromParent),
+                expectedMatrix,
+                atol=1e-6,
+            )
+        self.delayDisplay("Test passed")
 
-        inputScalarRange = inputVolume.GetImageData().GetScalarRange()
-        self.assertEqual(inputScalarRange[0], 0)
-        self.assertEqual(inputScalarRange[1], 695)
+    def test_TransferTagsPerformance(self):
+        """Transfer the tags of a long tagged sequence with many attributes, including per-frame
+        metadata arrays, to several derived sequences."""
+        import numpy as np
 
-        outputVolume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode")
-        threshold = 100
+        self.delayDisplay("Benchmarking transferTags")
+        logic = PerfusionHelperLogic()
+        numberOfFrames = 120
+        numberOfDestinations = 20
+        sourceNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode", "Source")
+        destNodes = [
+            slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode", "Destination")
+            for _ in range(numberOfDestinations)
+        ]
+        for metadataName in ["FrameTimes", "RepetitionTime", "EchoTime", "TriggerTime"]:
+            logic.setFrameMetadata(
+                sourceNode, metadataName, np.arange(numberOfFrames) * 1500.0
+            )
+        sourceNode.SetAttribute("MultiVolume.DICOM.EchoTime", "30.0")
+        for attributeIndex in range(5000):
+            sourceNode.SetAttribute("Test.Attribute%04i" % attributeIndex, str(attributeIndex))
+        for destNode in destNodes:
+            destNode.SetAttribute("MultiVolume.FrameLabels", "outdated")
+        frameLabels = " ".join(["%i" % (t * 1500) for t in range(numberOfFrames)])
+
+        self.assertWithinPerformanceBaseline(
+            "transferTags",
+            lambda: [logic.transferTags(sourceNode, destNode) for destNode in destNodes],
+        )
+        for destNode in destNodes:
+            self.assertIsNone(destNode.GetAttribute("MultiVolume.FrameLabels"))
+            self.assertEqual(destNode.GetAttribute("Test.Attribute4999"), "4999")
+            np.testing.assert_array_equal(
+                logic.getFrameMetadata(destNode, "FrameTimes"),
+                np.arange(numberOfFrames) * 1500.0,
+            )
+        logic.updateLegacyFrameAttributes(destNodes[0])
+        self.assertEqual(destNodes[0].GetAttribute("MultiVolume.FrameLabels"), frameLabels)
+        self.delayDisplay("Test passed")
 
-        # Test the module logic
+    def test_CreateElastixParameterFilePerformance(self):
+        """Create the parameter files of the per-frame registration jobs of a long sequence."""
+        import tempfile
 
+        self.delayDisplay("Benchmarking createElastixParameterFile")
         logic = PerfusionHelperLogic()
+        numberOfFrames = 300
+        with tempfile.TemporaryDirectory() as tempDir:
+            frameDirs = [
+                os.path.join(tempDir, "frame%04i" % itemNumber)
+                for itemNumber in range(numberOfFrames)
+            ]
+            for frameDir in frameDirs:
+                os.makedirs(frameDir)
+            parameterFilePaths = self.assertWithinPerformanceBaseline(
+                "createElastixParameterFile",
+                lambda: [
+                    logic.createElastixParameterFile(frameDir, prealigned=True, Scales=5000)
+                    for frameDir in frameDirs
+                ],
+            )
+            with open(parameterFilePaths[-1]) as f:
+                parameterFileText = f.read()
+        self.assertEqual(len(parameterFilePaths), numberOfFrames)
+        self.assertIn("EulerTransform", parameterFileText)
+        self.delayDisplay("Test passed")
+
+    def test_ImportElastixTransformPerformance(self):
+        """Import the two-stage (translation, then Euler) elastix results of the per-frame
+        registration jobs of a long sequence."""
+        import tempfile
 
-        # Test algorithm with non-inverted threshold
-        logic.process(inputVolume, outputVolume, threshold, True)
-        outputScalarRange = outputVolume.GetImageData().GetScalarRange()
-        self.assertEqual(outputScalarRange[0], inputScalarRange[0])
-        self.assertEqual(outputScalarRange[1], threshold)
+        import numpy as np
+
+        self.delayDisplay("Benchmarking importElastixTransform")
+        logic = PerfusionHelperLogic()
+        numberOfFrames = 300
+        transformNodes = [
+            slicer.vtkMRMLLinearTransformNode() for _ in range(numberOfFrames)
+        ]
+        with tempfile.TemporaryDirectory() as fixtureDir:
+            self.writeElastixTransformFixture(fixtureDir)
+            self.assertWithinPerformanceBaseline(
+                "importElastixTransform",
+                lambda: [
+                    logic.importElastixTransform(fixtureDir, transformNode)
+                    for transformNode in transformNodes
+                ],
+            )
+
+        expectedMatrix = self.expectedElastixTransformFixtureMatrix()
+        for transformNode in [transformNodes[0], transformNodes[-1]]:
+            transformFromParent = vtk.vtkMatrix4x4()
+            transformNode.GetMatrixTransformFromParent(transformFromParent)
+            np.testing.assert_allclose(
+                slicer.util.arrayFromVTKMatrix(transformFromParent), expectedMatrix, atol=1e-6
+            )
+        self.delayDisplay("Test passed")
 
-        # Test algorithm with inverted threshold
-        logic.process(inputVolume, outputVolume, threshold, False)
-        outputScalarRange = outputVolume.GetImageData().GetScalarRange()
-        self.assertEqual(outputScalarRange[0], inputScalarRange[0])
-        self.assertEqual(outputScalarRange[1], inputScalarRange[1])
+    def test_ElastixRegistrationPerformance(self):
+        """Run runElastixRegistration of a T1 volume to a DSC frame with a stub elastix, so that
+        exporting the volumes, running the job and importing the result is measured without the
+        registration itself."""
+        import tempfile
 
+        import numpy as np
+
+        if os.name == "nt":
+            # The stub is a shell script
+            self.delayDisplay("Skipping elastix registration benchmark on Windows")
+            return
+        self.delayDisplay("Benchmarking runElastixRegistration")
+        logic = PerfusionHelperLogic()
+        fixedVolumeNode = self.createTestVolume("Fixed", dimensions=(128, 128, 20))
+        movingVolumeNode = self.createTestVolume("Moving", dimensions=(256, 256, 176))
+        transformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode")
+        with tempfile.TemporaryDirectory() as tempDir:
+            fixtureDir = os.path.join(tempDir, "fixture")
+            os.makedirs(fixtureDir)
+            self.writeElastixTransformFixture(fixtureDir)
+
+            class ElastixLogicStub:
+                def createTempDirectory(self):
+                    return tempfile.mkdtemp(dir=tempDir)
+
+            logic._elastixLogic = ElastixLogicStub()
+            logic._elastixExecutable = (self.writeStubElastix(tempDir, fixtureDir), None)
+            logic.deleteTempElastixFiles = True
+            self.assertWithinPerformanceBaseline(
+                "runElastixRegistration",
+                lambda: logic.runElastixRegistration(
+                    fixedVolumeNode, movingVolumeNode, elastixOutputTransform=transformNode
+                ),
+            )
+
+        expectedMatrix = self.expectedElastixTransformFixtureMatrix()
+        transformFromParent = vtk.vtkMatrix4x4()
+        transformNode.GetMatrixTransformFromParent(transformFromParent)
+        np.testing.assert_allclose(
+            slicer.util.arrayFromVTKMatrix(transformFromParent), expectedMatrix, atol=1e-6
+        )
+        self.delayDisplay("Test passed")
+
+    def test_GatherTagsFromDICOMTagPerformance(self):
+        """Gather tags of the sequences of a study, whose frames refer to generated DICOM files in a
+        temporary DICOM database."""
+        import tempfile
+
+        import numpy as np
+        from DICOMLib import DICOMUtils
+
+        self.delayDisplay("Benchmarking gatherTagsFromDICOMTag")
+        logic = PerfusionHelperLogic()
+        numberOfSequences = 100
+        numberOfFrames = 10
+        with tempfile.TemporaryDirectory() as dicomDir:
+            instanceUIDs = self.writeDICOMFixture(dicomDir, numberOfFrames)
+            with DICOMUtils.TemporaryDICOMDatabase() as db:
+                DICOMUtils.importDicom(dicomDir, db)
+                seqNodes = [
+                    self.createTestSequence(
+                        numberOfFrames,
+                        dimensions=(4, 4, 1),
+                        frameAttributes=lambda itemNumber: {
+                            "DICOM.instanceUIDs": instanceUIDs[itemNumber]
+                        },
+                    )
+                    for _ in range(numberOfSequences)
+                ]
+                results = self.assertWithinPerformanceBaseline(
+                    "gatherTagsFromDICOMTag",
+                    lambda: [logic.gatherTagsFromDICOMTag(seqNode) for seqNode in seqNodes],
+                )
+        for errorCode, errorMsg in results:
+            self.assertEqual(errorCode, 0, errorMsg)
+        seqNode = seqNodes[-1]
+        self.assertEqual(seqNode.GetAttribute("MultiVolume.DICOM.EchoTime"), "30.0")
+        self.assertEqual(seqNode.GetAttribute("MultiVolume.DICOM.FlipAngle"), "60.0")
+        # Only generated when handing the sequence to DSCMRIAnalysis
+        self.assertIsNone(seqNode.GetAttribute("MultiVolume.FrameLabels"))
+        logic.updateLegacyFrameAttributes(seqNode)
+        self.assertEqual(
+            seqNode.GetAttribute("MultiVolume.FrameLabels"),
+            " ".join(["%i" % (t * 1500) for t in range(numberOfFrames)]),
+        )
+        np.testing.assert_allclose(
+            logic.getFrameMetadata(seqNode, "FrameTimes"),
+            np.arange(numberOfFrames) * 1500.0,
+        )
         self.delayDisplay("Test passed")
@@ -0,0 +1,204 @@
+"""Standalone worker for registration jobs written to a shared directory by
+PerfusionHelperLogic.submitElastixRegistrationJobToSharedDirectory.
+
+Each job is a sub-directory of the shared directory with a job.json manifest. A worker claims a job
+by creating its job.lock file (which only one worker can create), runs elastix in the job directory
+and marks the job with job.done or job.failed. Any number of workers, on any machines that see the
+shared directory, can run at the same time. While a job runs, its worker touches job.lock every
+HEARTBEAT_INTERVAL seconds (or --heartbeat-interval, which must be shorter than the stale lock
+timeout of the coordinator). The coordinator deletes locks that stopped changing (the worker died),
+which makes the job available again; a worker whose lock was deleted or taken over stops its job.
+
+This script only needs Python and an elastix executable, not Slicer:
+
+    python RegistrationWorker.py /shared/dir --elastix /path/to/elastix --threads 4
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+# Seconds between updates of the job.lock modification time of a running job
+HEARTBEAT_INTERVAL = 10.0
+
+
+def claimJob(jobDir):
+    """Atomically claim the job in jobDir. Returns the claim token written to the lock file, or None
+    if another worker already claimed the job."""
+    try:
+        fd = os.open(
+            os.path.join(jobDir, "job.lock"), os.O_CREAT | os.O_EXCL | os.O_WRONLY
+        )
+    except FileExistsError:
+        return None
+    token = uuid.uuid4().hex
+    with os.fdopen(fd, "w") as f:
+        f.write("%s %i %s\n" % (socket.gethostname(), os.getpid(), token))
+    return token
+
+
+def updateHeartbeat(jobDir, token):
+    """Touch the lock file of a claimed job. Returns False if the lock was deleted or taken over
+    by another worker in the meantime."""
+    lockPath = os.path.join(jobDir, "job.lock")
+    try:
+        with open(lockPath) as f:
+            if f.read().split()[-1:] != [token]:
+                return False
+        os.utime(lockPath)
+    except (OSError, IndexError):
+        return False
+    return True
+
+
+def findAvailableJobs(sharedDir):
+    """Return the job directories in sharedDir that are ready and not claimed yet, oldest first."""
+    jobDirs = []
+    for name in os.listdir(sharedDir):
+        jobDir = os.path.join(sharedDir, name)
+        if not os.path.exists(os.path.join(jobDir, "job.json")):
+            continue
+        if any(
+            os.path.exists(os.path.join(jobDir, fileName))
+            for fileName in ["job.lock", "job.done", "job.failed"]
+        ):
+            continue
+        try:
+            jobDirs.append((os.path.getmtime(jobDir), jobDir))
+        except FileNotFoundError:
+            # Removed by the coordinator in the meantime
+            continue
+    return [jobDir for _, jobDir in sorted(jobDirs)]
+
+
+def runJob(
+    jobDir,
+    elastixExecutable,
+    numberOfThreads=None,
+    token=None,
+    heartbeatInterval=HEARTBEAT_INTERVAL,
+):
+    """Run the elastix registration described by jobDir/job.json and mark the job as done or failed.
+    With the claim token, the lock heartbeat is updated while elastix runs, and elastix is stopped
+    without marking the job if the lock is lost. Returns None in that case."""
+    with open(os.path.join(jobDir, "job.json")) as f:
+        manifest = json.load(f)
+    commandLine = [elastixExecutable] + manifest["arguments"]
+    if numberOfThreads:
+        commandLine += ["-threads", str(numberOfThreads)]
+    startTime = time.time()
+    with open(os.path.join(jobDir, "elastix_output.txt"), "w") as logFile:
+        try:
+            process = subprocess.Popen(
+                commandLine, cwd=jobDir, stdout=logFile, stderr=subprocess.STDOUT
+            )
+        except OSError as e:
+            process = None
+            errorMsg = "could not run %s: %s" % (elastixExecutable, e)
+        while process is not None:
+            try:
+                returnCode = process.wait(timeout=heartbeatInterval)
+            except subprocess.TimeoutExpired:
+                if token is None or updateHeartbeat(jobDir, token):
+                    continue
+                logging.warning("Lost the lock of job %s, stopping it" % jobDir)
+                process.kill()
+                process.wait()
+                return None
+            errorMsg = "elastix return code %i" % returnCode if returnCode else None
+            break
+    # Write the marker file atomically, the coordinator imports the result as soon as it appears
+    markerPath = os.path.join(jobDir, "job.failed" if errorMsg else "job.done")
+    with open(markerPath + ".tmp", "w") as f:
+        f.write(
+            "%s on %s after %.1f s\n"
+            % (errorMsg or "completed", socket.gethostname(), time.time() - startTime)
+        )
+    os.replace(markerPath + ".tmp", markerPath)
+    return errorMsg is None
+
+
+def runWorker(
+    sharedDir,
+    elastixExecutable="elastix",
+    numberOfThreads=None,
+    pollInterval=1.0,
+    exitWhenIdle=False,
+    heartbeatInterval=HEARTBEAT_INTERVAL,
+):
+    """Process jobs from sharedDir until interrupted (or, with exitWhenIdle, until no job is left).
+    Returns the number of jobs processed."""
+    numberOfProcessedJobs = 0
+    while True:
+        claimedJob = None
+        for jobDir in findAvailableJobs(sharedDir):
+            token = claimJob(jobDir)
+            if token:
+                claimedJob = jobDir
+                break
+        if claimedJob is None:
+            if exitWhenIdle:
+                return numberOfProcessedJobs
+            time.sleep(pollInterval)
+            continue
+        logging.info("Running registration job %s" % claimedJob)
+        if (
+            runJob(claimedJob, elastixExecutable, numberOfThreads, token, heartbeatInterval)
+            is False
+        ):
+            logging.error("Registration job %s failed" % claimedJob)
+        numberOfProcessedJobs += 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run PerfusionHelper registration jobs from a shared directory"
+    )
+    parser.add_argument("sharedDir", help="directory the jobs are written to")
+    parser.add_argument(
+        "--elastix",
+        default=os.environ.get("ELASTIX_EXECUTABLE", "elastix"),
+        help="elastix executable (default: $ELASTIX_EXECUTABLE or elastix on the PATH)",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=None, help="elastix threads per job"
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=1.0,
+        help="seconds to wait before looking for new jobs",
+    )
+    parser.add_argument(
+        "--heartbeat-interval",
+        type=float,
+        default=HEARTBEAT_INTERVAL,
+        help="seconds between lock updates of a running job, must be shorter than the stale lock "
+        "timeout of the coordinator (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--exit-when-idle",
+        action="store_true",
+        help="exit when there are no jobs left instead of waiting for new ones",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    runWorker(
+        args.sharedDir,
+        args.elastix,
+        args.threads,
+        args.poll_interval,
+        args.exit_when_idle,
+        args.heartbeat_interval,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())